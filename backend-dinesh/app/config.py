@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,3 +7,31 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+
+# ML job queue: SQLite file + number of pipeline worker processes.
+# ML_WORKERS=0 keeps the web process from starting workers
+# (run `python -m app.worker` separately instead). Either way one pool
+# runs per machine, guarded by ML_POOL_LOCK.
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", str(BACKEND_ROOT / "outputs" / "jobs.sqlite3"))
+ML_WORKERS = int(os.getenv("ML_WORKERS", "1"))
+# held by the one process running the workers (first web process or app.worker)
+ML_POOL_LOCK = os.getenv("ML_POOL_LOCK", JOB_DB_PATH + ".workers.lock")
+# how often dead workers are respawned and their jobs requeued
+ML_SUPERVISE_SECONDS = float(os.getenv("ML_SUPERVISE_SECONDS", "15"))
+
+# Pipeline stage checkpoint cache (unset = disabled)
+ML_CACHE_DIR = os.getenv("ML_CACHE_DIR")
+ML_CACHE_MAX_GB = float(os.getenv("ML_CACHE_MAX_GB", "20"))
+
+# Lung segmentation: full | fast (lungmask on every N-th slice) | classical (no network)
+ML_SEG_MODE = os.getenv("ML_SEG_MODE", "full")
+ML_SEG_DOWNSAMPLE = int(os.getenv("ML_SEG_DOWNSAMPLE", "2"))
+ML_SEG_BATCH_SIZE = int(os.getenv("ML_SEG_BATCH_SIZE", "20"))
+ML_SEG_THREADS = int(os.getenv("ML_SEG_THREADS", "0")) or None
+
+# Memory-budget mode for the pipeline (GB per worker; unset = off)
+ML_MEM_BUDGET_GB = float(os.getenv("ML_MEM_BUDGET_GB", "0")) or None
+
+# Preprocessed 1 mm volumes (.ctvol) kept for viewers / reruns (unset = off)
+ML_VOLUME_STORE_DIR = os.getenv("ML_VOLUME_STORE_DIR")
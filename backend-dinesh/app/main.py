@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.config import ML_WORKERS
 from app.routes import upload, process, cases, doctor, chat, scan_results, auth
+from app.worker import WorkerPool
 
 app = FastAPI(title="CT Backend FYP")
 
@@ -20,6 +22,18 @@ app.include_router(chat.router)
 app.include_router(scan_results.router)
 app.include_router(auth.router)
 
+# with several uvicorn workers only the first one to start runs the pool
+worker_pool = WorkerPool(ML_WORKERS)
+
+@app.on_event("startup")
+def start_workers():
+    if worker_pool.size > 0:
+        worker_pool.start()
+
+@app.on_event("shutdown")
+def stop_workers():
+    worker_pool.stop()
+
 @app.get("/")
 def root():
-    return {"message": "Backend Running"}
\ No newline at end of file
+    return {"message": "Backend Running"}
@@ -0,0 +1,221 @@
+# app/services/job_queue_service.py
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:  # optional; /proc is used instead (Linux)
+    psutil = None
+
+from app.config import JOB_DB_PATH
+from app.services.case_service import CaseService
+
+# Job state -> patient_ct_scans.status
+CASE_STATUS = {
+    "queued": "processing",
+    "running": "processing",
+    "failed": "failed",
+    "done": "completed",
+}
+
+# A job whose worker died mid-run is requeued at most this many times
+MAX_ATTEMPTS = 3
+
+def now_iso():
+    return datetime.utcnow().isoformat()
+
+def process_start_time(pid):
+    """
+    Start time of a process (psutil's create time, else clock ticks since
+    boot from /proc), so a reused pid is not mistaken for the original
+    worker. None when it cannot be read.
+    """
+    if psutil is not None:
+        try:
+            return float(psutil.Process(pid).create_time())
+        except (psutil.Error, OSError):
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # the command name may contain spaces; fields resume after ')'
+            return float(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _worker_alive(pid, started=None):
+    # never signal the pid: os.kill(pid, 0) terminates the process on Windows
+    if not pid:
+        return False
+    if psutil is not None:
+        if not psutil.pid_exists(pid):
+            return False
+    elif os.path.isdir("/proc") and not os.path.exists(f"/proc/{pid}"):
+        return False
+    if started is None:
+        return True   # rows claimed before start times were recorded
+    current = process_start_time(pid)
+    return current is None or current == started
+
+class JobQueueService:
+
+    @staticmethod
+    def _connect():
+        Path(JOB_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        # autocommit; transactions are opened explicitly where needed
+        conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ml_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                case_id TEXT NOT NULL,
+                storage_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_pid INTEGER,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ml_jobs_status ON ml_jobs (status, id)")
+        # start time of the claiming worker: pid + start time identify it
+        cols = {r["name"] for r in conn.execute("PRAGMA table_info(ml_jobs)")}
+        if "worker_started" not in cols:
+            try:
+                conn.execute("ALTER TABLE ml_jobs ADD COLUMN worker_started REAL")
+            except sqlite3.OperationalError:
+                pass  # added concurrently by another process
+        return conn
+
+    @staticmethod
+    def _sync_case(case_id: str, status: str):
+        try:
+            CaseService.update_status(case_id, CASE_STATUS[status])
+        except Exception as e:
+            print(f"[QUEUE] Could not sync case {case_id} -> {status}: {e}")
+
+    @staticmethod
+    def enqueue(case_id: str, storage_path: str):
+        """Queue a case unless it is already queued or running."""
+        conn = JobQueueService._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM ml_jobs WHERE case_id = ? AND status IN ('queued', 'running')",
+                (case_id,)
+            ).fetchone()
+            if row is None:
+                ts = now_iso()
+                cur = conn.execute(
+                    "INSERT INTO ml_jobs (case_id, storage_path, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?)",
+                    (case_id, storage_path, ts, ts)
+                )
+                row = conn.execute("SELECT * FROM ml_jobs WHERE id = ?", (cur.lastrowid,)).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        JobQueueService._sync_case(case_id, row["status"])
+        return dict(row)
+
+    @staticmethod
+    def claim_next(worker_pid: int):
+        """Atomically move the oldest queued job to running. Returns None if empty."""
+        conn = JobQueueService._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM ml_jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE ml_jobs SET status = 'running', worker_pid = ?, worker_started = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_pid, process_start_time(worker_pid), now_iso(), row["id"])
+            )
+            job = conn.execute("SELECT * FROM ml_jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        JobQueueService._sync_case(job["case_id"], "running")
+        return dict(job)
+
+    @staticmethod
+    def _finish(job: dict, status: str, error: str = None):
+        conn = JobQueueService._connect()
+        try:
+            conn.execute(
+                "UPDATE ml_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, now_iso(), job["id"])
+            )
+        finally:
+            conn.close()
+        JobQueueService._sync_case(job["case_id"], status)
+
+    @staticmethod
+    def mark_done(job: dict):
+        JobQueueService._finish(job, "done")
+
+    @staticmethod
+    def mark_failed(job: dict, error: str):
+        JobQueueService._finish(job, "failed", error)
+
+    @staticmethod
+    def recover_orphans():
+        """
+        Requeue jobs left 'running' by a worker that no longer exists
+        (uvicorn restart, crash, OOM kill); a live process that reuses the
+        pid does not count. Gives up after MAX_ATTEMPTS. Safe to call
+        periodically (the worker supervisor does).
+        """
+        conn = JobQueueService._connect()
+        requeued, failed = [], []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT * FROM ml_jobs WHERE status = 'running'").fetchall()
+            for row in rows:
+                if _worker_alive(row["worker_pid"], row["worker_started"]):
+                    continue
+                if row["attempts"] >= MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE ml_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                        ("worker died too many times", now_iso(), row["id"])
+                    )
+                    failed.append(dict(row))
+                else:
+                    conn.execute(
+                        "UPDATE ml_jobs SET status = 'queued', worker_pid = NULL, worker_started = NULL, "
+                        "updated_at = ? WHERE id = ?",
+                        (now_iso(), row["id"])
+                    )
+                    requeued.append(dict(row))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        for job in requeued:
+            print(f"[QUEUE] Requeued orphaned job {job['id']} (case {job['case_id']})")
+            JobQueueService._sync_case(job["case_id"], "queued")
+        for job in failed:
+            print(f"[QUEUE] Giving up on job {job['id']} (case {job['case_id']})")
+            JobQueueService._sync_case(job["case_id"], "failed")
+        return len(requeued)
+
+    @staticmethod
+    def get_latest_job(case_id: str):
+        conn = JobQueueService._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM ml_jobs WHERE case_id = ? ORDER BY id DESC LIMIT 1",
+                (case_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
@@ -0,0 +1,141 @@
+# app/worker.py
+#
+# Drains the ML job queue with a fixed pool of worker processes.
+# Each worker keeps one warm PipelineEngine, so models load once per process.
+#
+# Usage (standalone, with ML_WORKERS=0 on the web process):
+#   python -m app.worker --workers 2
+import argparse
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from filelock import FileLock, Timeout
+
+from app.config import ML_WORKERS, ML_SUPERVISE_SECONDS, ML_POOL_LOCK
+
+POLL_SECONDS = 2.0
+
+def worker_loop(stop_event=None):
+    # imported here so the parent process never loads torch / the models
+    from app.services.job_queue_service import JobQueueService
+    from app.services.ml_service import MLService
+
+    pid = os.getpid()
+    print(f"[WORKER {pid}] Started")
+
+    while stop_event is None or not stop_event.is_set():
+        job = JobQueueService.claim_next(pid)
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+
+        print(f"[WORKER {pid}] Running job {job['id']} (case {job['case_id']})")
+        try:
+            MLService.run_pipeline(job["case_id"], job["storage_path"])
+            JobQueueService.mark_done(job)
+            print(f"[WORKER {pid}] Job {job['id']} done")
+        except Exception as e:
+            traceback.print_exc()
+            print(f"[WORKER {pid}] Job {job['id']} failed: {e}")
+            JobQueueService.mark_failed(job, str(e))
+
+    print(f"[WORKER {pid}] Stopped")
+
+class WorkerPool:
+    """
+    Fixed-size pool of pipeline worker processes. A supervisor thread
+    respawns workers that died (OOM kill, segfault) and requeues the jobs
+    they left running, every `supervise_seconds`.
+    Only one pool per machine runs: start() takes an exclusive lock file
+    (freed when its process exits), so each uvicorn web process does not
+    start its own workers.
+    """
+
+    def __init__(self, size: int = ML_WORKERS, supervise_seconds: float = ML_SUPERVISE_SECONDS,
+                 lock_path: str = ML_POOL_LOCK):
+        self.size = max(0, int(size))
+        self.supervise_seconds = supervise_seconds
+        self._lock = FileLock(lock_path)
+        self.running = False
+        # spawn: torch / SimpleITK threads do not survive fork
+        self._ctx = mp.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._procs = []
+        self._supervisor = None
+
+    def _spawn(self):
+        p = self._ctx.Process(target=worker_loop, args=(self._stop,), daemon=True)
+        p.start()
+        return p
+
+    def _supervise(self):
+        from app.services.job_queue_service import JobQueueService
+
+        while not self._stop.wait(self.supervise_seconds):
+            for i, p in enumerate(self._procs):
+                if not p.is_alive():
+                    print(f"[QUEUE] Worker {p.pid} died (exit code {p.exitcode}); respawning")
+                    p.join(0)
+                    self._procs[i] = self._spawn()
+            try:
+                # the dead worker's job goes back to the queue (or fails after MAX_ATTEMPTS)
+                JobQueueService.recover_orphans()
+            except Exception as e:
+                print(f"[QUEUE] Orphan recovery failed: {e}")
+
+    def start(self):
+        from app.services.job_queue_service import JobQueueService
+
+        Path(self._lock.lock_file).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._lock.acquire(timeout=0)
+        except Timeout:
+            print(f"[QUEUE] Another process runs the ML workers ({self._lock.lock_file}); not starting")
+            return self
+        self.running = True
+        JobQueueService.recover_orphans()
+        self._procs = [self._spawn() for _ in range(self.size)]
+        self._supervisor = threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True)
+        self._supervisor.start()
+        print(f"[QUEUE] Started {self.size} ML worker(s)")
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        # workers finish their current poll; a job still running after the
+        # timeout is killed and requeued by recover_orphans() on next start
+        self._stop.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+        if self.running:
+            self._lock.release()
+            self.running = False
+
+    def join(self):
+        # workers come and go; the supervisor runs until stop()
+        if self._supervisor is not None:
+            self._supervisor.join()
+        for p in self._procs:
+            p.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=max(1, ML_WORKERS), help="Number of worker processes")
+    args = parser.parse_args()
+
+    pool = WorkerPool(args.workers).start()
+    if not pool.running:
+        raise SystemExit(1)
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,260 @@
+# backend-dinesh/ml/bench/bench_stages.py
+#
+# Offline per-stage micro-benchmarks on synthetic phantoms (no patient data,
+# no network). Reports time, throughput and detection recall per stage, and
+# can compare against a saved baseline to catch performance regressions.
+#
+# Usage:
+#   python backend-dinesh/ml/bench/bench_stages.py --json bench.json
+#   python backend-dinesh/ml/bench/bench_stages.py --baseline bench.json --tolerance 0.25
+
+import argparse
+import importlib.util
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent.parent   # backend-dinesh/
+
+
+def load_module_from(path, name):
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def timed(fn, repeats):
+    """Returns (median seconds, last result)."""
+    times, out = [], None
+    for _ in range(max(1, repeats)):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)), out
+
+
+def _risk_head(risk_mod, tmp_dir):
+    model_path = ROOT / "models" / "risk_head" / "risk_head.pth"
+    scaler_path = ROOT / "models" / "risk_head" / "risk_scaler.pkl"
+    if not (model_path.exists() and scaler_path.exists()):
+        # random weights are fine for timing
+        import joblib
+        import torch
+        from sklearn.preprocessing import StandardScaler
+        model_path = Path(tmp_dir) / "risk_head.pth"
+        scaler_path = Path(tmp_dir) / "risk_scaler.pkl"
+        net = torch.nn.Sequential(
+            torch.nn.Linear(4, 32), torch.nn.ReLU(), torch.nn.Dropout(0.2),
+            torch.nn.Linear(32, 16), torch.nn.ReLU(), torch.nn.Dropout(0.1),
+            torch.nn.Linear(16, 1), torch.nn.Sigmoid())
+        torch.save(net.state_dict(), model_path)
+        joblib.dump(StandardScaler().fit(np.random.default_rng(0).normal(size=(64, 4))), scaler_path)
+    return risk_mod.RiskHead(model_path, scaler_path)
+
+
+def run_bench(spacing=(2.5, 0.7, 0.7), fov_mm=(120.0, 220.0, 220.0), n_nodules=6,
+              seed=0, repeats=3, stages=None, order_by_response=True):
+    phantom = load_module_from(ROOT/"ml"/"bench"/"phantom.py", "phantom")
+    resample_mod = load_module_from(ROOT/"ml"/"preprocessing"/"resample.py", "resample")
+    normalize_mod = load_module_from(ROOT/"ml"/"preprocessing"/"normalize.py", "normalize")
+    log_mod = load_module_from(ROOT/"ml"/"detection"/"log_detector.py", "log_detector")
+    base_filter_mod = load_module_from(ROOT/"ml"/"detection"/"filter_candidates.py", "filter_candidates")
+    patch_mod = load_module_from(ROOT/"ml"/"detection"/"patch_extractor.py", "patch_extractor")
+    smart_mod = load_module_from(ROOT/"ml"/"detection"/"smart_filter.py", "smart_filter")
+    table_mod = load_module_from(ROOT/"ml"/"detection"/"candidate_table.py", "candidate_table")
+    feat_mod = load_module_from(ROOT/"ml"/"features"/"feature_extractor.py", "feature_extractor")
+
+    want = set(stages) if stages else None
+    results = {}
+
+    def record(name, seconds, items, unit, **extra):
+        results[name] = {
+            "seconds": round(seconds, 6),
+            "items": int(items),
+            "throughput": round(items / seconds, 3) if seconds > 0 else None,
+            "unit": unit,
+            **extra,
+        }
+        tp = results[name]["throughput"]
+        print(f"  {name:<24} {seconds:9.4f} s   {tp if tp is not None else '-':>14} {unit}"
+              + "".join(f"   {k}={v}" for k, v in extra.items()))
+
+    # scanner-like anisotropic phantom + its 1 mm twin (same anatomy, same nodules)
+    print(f"[BENCH] Phantom fov={fov_mm} mm, spacing={spacing}, nodules={n_nodules}, seed={seed}")
+    nodules = phantom.random_nodules(fov_mm, n_nodules, seed=seed)
+    vol, sp, _, _ = phantom.make_phantom(spacing, fov_mm, nodules=nodules, seed=seed)
+    vol_iso, _, lung_mask, truth = phantom.make_phantom((1.0, 1.0, 1.0), fov_mm, nodules=nodules, seed=seed)
+    print(f"[BENCH] Scan {vol.shape}, iso {vol_iso.shape}, repeats={repeats}\n")
+
+    if want is None or "resample_to_iso" in want:
+        s, (vol_res, _) = timed(lambda: resample_mod.resample_to_iso(vol, sp, new_spacing=[1, 1, 1]), repeats)
+        record("resample_to_iso", s, vol_res.size / 1e6, "Mvox/s")
+    if want is None or "resample_slabs" in want:
+        s, (vol_res, _) = timed(lambda: resample_mod.resample_to_iso(vol, sp, new_spacing=[1, 1, 1], mode="slab"), repeats)
+        record("resample_slabs", s, vol_res.size / 1e6, "Mvox/s")
+        del vol_res
+
+    if want is None or "classical_segment" in want:
+        # the network modes need the lungmask weights; the classical one is timed here
+        lung_mod = load_module_from(ROOT/"ml"/"preprocessing"/"lung_segmentation.py", "lung_segmentation")
+        s, seg = timed(lambda: lung_mod.classical_segment(vol_iso), repeats)
+        seg, ref = seg > 0, lung_mask > 0
+        dice = 2 * np.count_nonzero(seg & ref) / max(1, np.count_nonzero(seg) + np.count_nonzero(ref))
+        record("classical_segment", s, vol_iso.size / 1e6, "Mvox/s", dice=round(float(dice), 4))
+        del seg, ref
+
+    # downstream stages run on the iso twin so masks and truth line up exactly
+    vol_norm = normalize_mod.clip_and_normalize(vol_iso)
+
+    s, (cands, log_resp) = timed(lambda: log_mod.log_nodule_candidates(vol_norm, lung_mask, sigma=1.0, threshold=0.002), repeats)
+    if want is None or "log_nodule_candidates" in want:
+        record("log_nodule_candidates", s, vol_norm.size / 1e6, "Mvox/s",
+               candidates=len(cands), recall=round(phantom.recall(cands, truth), 3))
+    if want is None or "log_nodule_candidates_tiled" in want:
+        s, (tiled, _) = timed(lambda: log_mod.log_nodule_candidates_tiled(vol_norm, lung_mask, sigma=1.0, threshold=0.002), repeats)
+        record("log_nodule_candidates_tiled", s, vol_norm.size / 1e6, "Mvox/s",
+               candidates=len(tiled), identical=tiled == cands)
+        del tiled
+    if want is None or "dog_candidates" in want:
+        dog_mod = load_module_from(ROOT/"ml"/"detection"/"dog_detector.py", "dog_detector")
+        s, (dog, _, _) = timed(lambda: dog_mod.dog_candidates(vol_norm, lung_mask, threshold=0.04), repeats)
+        record("dog_candidates", s, vol_norm.size / 1e6, "Mvox/s",
+               candidates=len(dog), recall=round(phantom.recall(dog, truth), 3))
+        del dog
+
+    # as in the pipeline: (N,3) peaks, strongest LoG response first
+    # (--raster_order: detector order); the other order's recall is reported too
+    peaks = np.asarray(cands, dtype=np.int32).reshape(-1, 3)
+    scores = log_resp[tuple(peaks.T)]
+    del log_resp
+    s, keep = timed(lambda: base_filter_mod.filter_candidates(peaks, vol_iso, lung_mask, min_hu=-700, min_dist=6,
+                                                               scores=scores if order_by_response else None,
+                                                               return_index=True), repeats)
+    filtered = table_mod.new_table(peaks[keep], response=scores[keep])
+    if want is None or "filter_candidates" in want:
+        other = base_filter_mod.filter_candidates(peaks, vol_iso, lung_mask, min_hu=-700, min_dist=6,
+                                                  scores=None if order_by_response else scores, return_index=True)
+        record("filter_candidates", s, len(cands), "cand/s",
+               kept=len(filtered), recall=round(phantom.recall(table_mod.centers(filtered), truth), 3),
+               recall_other_order=round(phantom.recall(peaks[other], truth), 3))
+
+    def _features():
+        table = filtered.copy()
+        patches = patch_mod.extract_patches(vol_iso, table_mod.centers(table), size=32, fill=-1024)
+        feats = feat_mod.batch_patch_features(patches, spacing=(1.0, 1.0, 1.0), segment=True)
+        for name in table_mod.FEATURES:
+            table[name] = feats[name]
+        return table
+
+    s, feats = timed(_features, repeats)
+    if want is None or "extract_patch_features" in want:
+        record("extract_patch_features", s, len(filtered), "cand/s")
+
+    if want is None or "nodule_size" in want:
+        # size accuracy: patches at the true nodule centres, measured long
+        # axis vs the implanted diameter (whole threshold mask for reference)
+        true_d = np.array([t["diameter_mm"] for t in truth])
+        centers = np.rint([t["center_mm"] for t in truth]).astype(np.int32).reshape(-1, 3)
+        patches = patch_mod.extract_patches(vol_iso, centers, size=32, fill=-1024)
+        s, seg = timed(lambda: feat_mod.batch_patch_features(patches, segment=True), repeats)
+        whole = feat_mod.batch_patch_features(patches, segment=False)
+        record("nodule_size", s, len(truth), "nod/s",
+               mae_long_axis_mm=round(float(np.abs(seg["long_axis_mm"] - true_d).mean()), 2),
+               mae_whole_mask_mm=round(float(np.abs(whole["long_axis_mm"] - true_d).mean()), 2))
+        del patches
+
+    if want is None or "rejection_cascade" in want:
+        cascade_mod = load_module_from(ROOT/"ml"/"features"/"cascade.py", "cascade")
+        # as in the pipeline: patches cut 64 at a time into one buffer
+        centers = table_mod.centers(filtered)
+        buf = patch_mod.patch_buffer(min(64, len(centers)), 32, vol_iso.dtype)
+        get = lambda a, b: patch_mod.extract_patches(vol_iso, centers[a:b], size=32, fill=-1024, out=buf[:b - a])
+        s, (keep, _, report) = timed(lambda: cascade_mod.run_cascade_chunks(get, len(centers)), repeats)
+        record("rejection_cascade", s, len(filtered), "cand/s", kept=len(keep),
+               **{f"rej_{r['name']}": r["rejected"] for r in report})
+        del buf
+
+    s, final = timed(lambda: smart_mod.smart_filter(feats), repeats)
+    if want is None or "smart_filter" in want:
+        record("smart_filter", s, len(filtered), "cand/s",
+               kept=len(final), recall=round(phantom.recall(table_mod.centers(final), truth), 3))
+
+    if want is None or "findings_json" in want:
+        # final nodules plus two candidates at opposite corners of the scan:
+        # their patches run past the volume, their bbox must not
+        builder_mod = load_module_from(ROOT/"ml"/"json_builder"/"builder.py", "builder")
+        corners = table_mod.new_table(np.array([[0, 0, 0], np.array(vol_iso.shape) - 1], dtype=np.int32))
+        nodules = np.concatenate([final, corners])
+        s, findings = timed(lambda: builder_mod.build_findings_json(
+            "bench", [1.0, 1.0, 1.0], vol_iso.shape, nodules, None, lung_metrics=(0.0, 0.0, 0.0)), repeats)
+        inside = all(0 <= lo <= hi < n for f in findings["nodules"]
+                     for (lo, hi), n in zip((f["bbox"][k] for k in "zyx"), vol_iso.shape))
+        record("findings_json", s, len(nodules), "nod/s", bbox_in_volume=inside)
+
+    if want is None or "RiskHead" in want:
+        risk_mod = load_module_from(ROOT/"ml"/"risk"/"predict_risk.py", "predict_risk")
+        with tempfile.TemporaryDirectory() as tmp:
+            risk = _risk_head(risk_mod, tmp)
+            rows = np.stack([feats[k] for k in ("hu_mean", "hu_std", "long_axis_mm", "volume_mm3")], axis=1).tolist() or [[0.0] * 4]
+            s, _ = timed(lambda: [risk.predict(r) for r in rows], repeats)
+            record("RiskHead", s, len(rows), "pred/s")
+
+    return {
+        "phantom": {"spacing": list(sp), "fov_mm": list(fov_mm), "shape": list(vol.shape),
+                    "n_nodules": n_nodules, "seed": seed},
+        "stages": results,
+    }
+
+
+def compare(report, baseline, tolerance=0.25):
+    """
+    Lists regressions: slower than baseline*(1+tolerance), lower recall,
+    or a failed check (identical, bbox_in_volume).
+    """
+    problems = []
+    for name, cur in report["stages"].items():
+        problems += [f"{name}: {k} is False" for k, v in cur.items() if v is False]
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if cur["seconds"] > base["seconds"] * (1.0 + tolerance):
+            problems.append(f"{name}: {cur['seconds']:.4f}s vs baseline {base['seconds']:.4f}s")
+        if "recall" in base and cur.get("recall", 1.0) < base["recall"]:
+            problems.append(f"{name}: recall {cur.get('recall')} vs baseline {base['recall']}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spacing", type=float, nargs=3, default=[2.5, 0.7, 0.7], help="Scan spacing z y x (mm)")
+    parser.add_argument("--fov_mm", type=float, nargs=3, default=[120.0, 220.0, 220.0], help="Field of view z y x (mm); the raw LoG output grows with it")
+    parser.add_argument("--nodules", type=int, default=6, help="Number of implanted nodules")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="*", help="Only report these stages")
+    parser.add_argument("--raster_order", action="store_true", help="Filter: visit the peaks in detector order, not strongest first")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --json report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    report = run_bench(args.spacing, tuple(args.fov_mm), args.nodules, args.seed, args.repeats, args.stages,
+                       not args.raster_order)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+        print(f"\n[BENCH] Report written to {args.json}")
+
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if problems:
+            print("\n[BENCH] REGRESSIONS:")
+            for p in problems:
+                print("  - " + p)
+            sys.exit(1)
+        print("\n[BENCH] No regressions against baseline.")
@@ -0,0 +1,144 @@
+# backend-dinesh/ml/bench/phantom.py
+#
+# Synthetic chest-CT-like phantoms for offline benchmarks (no patient data).
+# Geometry is defined in millimetres, so the same seed gives the same anatomy
+# at any voxel spacing (e.g. a 2.5 mm scan and its 1 mm resampled twin).
+#
+#   vol, spacing, lung_mask, truth = make_phantom(spacing=(2.5, 0.7, 0.7), n_nodules=6, seed=0)
+
+import numpy as np
+
+AIR_HU = -1000
+BODY_HU = 40
+LUNG_HU = -860
+VESSEL_HU = 40
+SOLID_HU = 30
+GGO_HU = -600
+
+
+def _grid(shape, spacing, offset=(0.0, 0.0, 0.0)):
+    """Voxel-centre coordinates in mm, broadcastable (Z,1,1),(1,Y,1),(1,1,X)."""
+    z = (np.arange(shape[0]) * spacing[0] - offset[0]).reshape(-1, 1, 1)
+    y = (np.arange(shape[1]) * spacing[1] - offset[1]).reshape(1, -1, 1)
+    x = (np.arange(shape[2]) * spacing[2] - offset[2]).reshape(1, 1, -1)
+    return z, y, x
+
+
+def _lung_centres(fov_mm):
+    Z, Y, X = fov_mm
+    # (centre z, y, x), (semi-axes z, y, x) for the right and left lung
+    axes = (0.45 * Z, 0.28 * Y, 0.17 * X)
+    return [((0.5 * Z, 0.5 * Y, 0.31 * X), axes),
+            ((0.5 * Z, 0.5 * Y, 0.69 * X), axes)]
+
+
+def _inside_lung(p, fov_mm, shrink=0.8):
+    for c, a in _lung_centres(fov_mm):
+        r = sum(((p[i] - c[i]) / (a[i] * shrink)) ** 2 for i in range(3))
+        if r < 1.0:
+            return True
+    return False
+
+
+def random_nodules(fov_mm, n, seed=0, diam_range=(4.0, 30.0), ggo_fraction=0.25):
+    """n nodules placed inside the lungs with random diameters (mm)."""
+    rng = np.random.default_rng(seed)
+    nodules = []
+    while len(nodules) < n:
+        p = rng.uniform(0, 1, 3) * np.array(fov_mm)
+        if not _inside_lung(p, fov_mm):
+            continue
+        d = float(rng.uniform(*diam_range))
+        # keep nodules apart so each one is a separate detection target
+        if any(np.linalg.norm(p - np.array(o["center_mm"])) < (d + o["diameter_mm"]) / 2 + 10 for o in nodules):
+            continue
+        kind = "ground-glass" if rng.uniform() < ggo_fraction else "solid"
+        nodules.append({
+            "center_mm": [float(v) for v in p],
+            "diameter_mm": d,
+            "kind": kind,
+            "hu": GGO_HU if kind == "ground-glass" else SOLID_HU,
+        })
+    return nodules
+
+
+def make_phantom(spacing=(2.5, 0.7, 0.7), fov_mm=(300.0, 340.0, 340.0),
+                 nodules=None, n_nodules=6, n_vessels=12, noise_hu=15.0, seed=0):
+    """
+    Returns (volume int16 HU (Z,Y,X), spacing [z,y,x], lung_mask uint8, truth).
+    truth: list of nodule dicts with center_mm, center_vox, diameter_mm, kind, hu.
+    nodules: explicit list (see random_nodules) or None for n_nodules random ones.
+    """
+    spacing = [float(s) for s in spacing]
+    shape = tuple(int(round(f / s)) for f, s in zip(fov_mm, spacing))
+    z, y, x = _grid(shape, spacing)
+    Zmm, Ymm, Xmm = fov_mm
+
+    vol = np.full(shape, AIR_HU, dtype=np.float32)
+
+    # body: elliptic cylinder along z
+    body = ((y - 0.5 * Ymm) / (0.46 * Ymm)) ** 2 + ((x - 0.5 * Xmm) / (0.47 * Xmm)) ** 2 < 1.0
+    vol[np.broadcast_to(body, shape)] = BODY_HU
+
+    # lungs: two ellipsoids
+    lung_mask = np.zeros(shape, dtype=np.uint8)
+    for label, (c, a) in enumerate(_lung_centres(fov_mm), start=1):
+        inside = ((z - c[0]) / a[0]) ** 2 + ((y - c[1]) / a[1]) ** 2 + ((x - c[2]) / a[2]) ** 2 < 1.0
+        lung_mask[inside] = label
+        vol[inside] = LUNG_HU
+
+    rng = np.random.default_rng(seed)
+
+    # vessels: thin tubes running roughly cranio-caudal inside the lungs
+    for _ in range(n_vessels):
+        c, a = _lung_centres(fov_mm)[rng.integers(2)]
+        y0 = c[1] + rng.uniform(-0.6, 0.6) * a[1]
+        x0 = c[2] + rng.uniform(-0.6, 0.6) * a[2]
+        dy, dx = rng.uniform(-0.3, 0.3, 2)
+        r = rng.uniform(1.0, 2.5)
+        tube = ((y - (y0 + dy * (z - c[0]))) ** 2 + (x - (x0 + dx * (z - c[0]))) ** 2) < r * r
+        vol[tube & (lung_mask > 0)] = VESSEL_HU
+
+    # nodules
+    if nodules is None:
+        nodules = random_nodules(fov_mm, n_nodules, seed=seed)
+    truth = []
+    for nod in nodules:
+        cz, cy, cx = nod["center_mm"]
+        rad = nod["diameter_mm"] / 2.0
+        # work on the nodule's bounding box only
+        box = tuple(
+            slice(max(0, int((c - rad - 2) / s)), min(n, int((c + rad + 2) / s) + 2))
+            for c, s, n in zip(nod["center_mm"], spacing, shape)
+        )
+        d2 = (z[box[0]] - cz) ** 2 + (y[:, box[1]] - cy) ** 2 + (x[:, :, box[2]] - cx) ** 2
+        sub = vol[box]
+        if nod["kind"] == "ground-glass":
+            # soft edge: HU ramps from the lung to the nodule over ~1 mm
+            w = np.clip(rad + 0.5 - np.sqrt(d2), 0.0, 1.0)
+            sub += (w * (nod["hu"] - sub)).astype(np.float32)
+        else:
+            sub[d2 < rad * rad] = nod["hu"]
+        t = dict(nod)
+        t["center_vox"] = [int(round(v / s)) for v, s in zip(nod["center_mm"], spacing)]
+        truth.append(t)
+
+    if noise_hu > 0:
+        vol += rng.normal(0.0, noise_hu, shape).astype(np.float32)
+
+    return np.clip(vol, -1024, 3071).astype(np.int16), spacing, lung_mask, truth
+
+
+def recall(centers, truth, spacing=(1.0, 1.0, 1.0), tol_mm=None):
+    """Fraction of truth nodules with a centre within max(radius, tol_mm) mm."""
+    if not truth:
+        return 1.0
+    pts = np.asarray(centers, dtype=np.float64).reshape(-1, 3) * np.asarray(spacing)
+    hit = 0
+    for t in truth:
+        if pts.shape[0] == 0:
+            break
+        r = max(t["diameter_mm"] / 2.0, tol_mm or 0.0, 3.0)
+        d = np.linalg.norm(pts - np.asarray(t["center_mm"]), axis=1)
+        hit += int(d.min() <= r)
+    return hit / len(truth)
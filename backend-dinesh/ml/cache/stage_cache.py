@@ -0,0 +1,193 @@
+# backend-dinesh/ml/cache/stage_cache.py
+#
+# Content-addressed checkpoint cache for the expensive pipeline stages.
+#
+# Every entry lives in <root>/<key>/ as one .npy file per array plus meta.json.
+# key = hash(stage name, stage params, parent keys), where the first parent
+# is the hash of the input series, so a cached stage is reused only when its
+# whole upstream chain (data + params + code) is unchanged.
+# Arrays come back memory-mapped (read-only). Least-recently-used entries are
+# evicted once the cache grows past max_bytes.
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+_CHUNK = 1 << 20
+
+
+def _hash_json(obj):
+    blob = json.dumps(obj, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(blob, digest_size=20).hexdigest()
+
+
+def file_digest(path):
+    """Hash of one file's bytes (used to key stages on their source code)."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def folder_listing_key(folder):
+    """Cheap key over relative paths + sizes (no content read). Also takes a dicom_source."""
+    if hasattr(folder, "list"):
+        return _hash_json([(name, folder.size(name)) for name in folder.list()])
+    folder = Path(folder)
+    listing = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            p = Path(root) / name
+            listing.append((p.relative_to(folder).as_posix(), p.stat().st_size))
+    return _hash_json(listing)
+
+
+def series_content_key(series, source=None):
+    """
+    Content hash of a series: a folder (every file in it) or a list of slice
+    files; with a dicom_source, a list of member names inside it.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if source is not None:
+        for name in series:
+            h.update(name.rsplit("/", 1)[-1].encode())
+            with source.open(name) as f:
+                while chunk := f.read(_CHUNK):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    if isinstance(series, (str, Path)):
+        files = sorted(x for x in Path(series).iterdir() if x.is_file())
+    else:
+        files = [Path(x) for x in series]
+    for p in files:
+        h.update(p.name.encode())
+        with open(p, "rb") as f:
+            while chunk := f.read(_CHUNK):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class StageCache:
+    """
+    root=None disables the cache: fetch() just calls compute().
+    """
+
+    def __init__(self, root=None, max_bytes=20 * 1024**3):
+        self.root = Path(root) if root else None
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.root is not None
+
+    def key(self, stage, params=None, *parents):
+        return _hash_json({"stage": stage, "params": params or {}, "parents": list(parents)})
+
+    # ---------------------
+    # Read / write entries
+    # ---------------------
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self.root / key
+        meta_path = entry / "meta.json"
+        if not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text())
+            arrays = {
+                name: np.load(entry / f"{name}.npy", mmap_mode="r")
+                for name in meta.get("_arrays", [])
+            }
+        except Exception as e:
+            print(f"[CACHE] Dropping unreadable entry {key}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # mark as recently used (LRU order = entry mtime)
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        meta.pop("_arrays", None)
+        return arrays, meta
+
+    def put(self, key, arrays=None, meta=None):
+        if not self.enabled:
+            return
+        arrays = arrays or {}
+        meta = dict(meta or {})
+        meta["_arrays"] = sorted(arrays)
+
+        entry = self.root / key
+        tmp = self.root / f".{key}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            for name, arr in arrays.items():
+                np.save(tmp / f"{name}.npy", np.ascontiguousarray(arr))
+            (tmp / "meta.json").write_text(json.dumps(meta, default=str))
+            os.rename(tmp, entry)
+        except OSError:
+            # another worker stored the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def fetch(self, stage, params, parents, compute):
+        """
+        Returns (key, arrays, meta). compute() -> (arrays, meta) only runs on a miss.
+        """
+        if not self.enabled:
+            arrays, meta = compute()
+            return None, arrays, meta
+
+        key = self.key(stage, params, *parents)
+        hit = self.get(key)
+        if hit is not None:
+            self.hits += 1
+            print(f"[CACHE] hit  {stage} ({key[:12]})")
+            return key, hit[0], hit[1]
+
+        self.misses += 1
+        arrays, meta = compute()
+        self.put(key, arrays, meta)
+        return key, arrays, meta
+
+    # ---------------------
+    # Size cap / LRU
+    # ---------------------
+    def _entries(self):
+        out = []
+        for entry in self.root.iterdir():
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+            out.append((entry.stat().st_mtime, size, entry))
+        return out
+
+    def evict(self):
+        if not self.enabled:
+            return 0
+        entries = sorted(self._entries(), key=lambda e: e[0])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        if removed:
+            print(f"[CACHE] Evicted {removed} entries (now {total / 1024**2:.0f} MB)")
+        return removed
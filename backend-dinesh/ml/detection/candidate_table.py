@@ -0,0 +1,36 @@
+import numpy as np
+
+# One row per candidate. Detection fills the coordinates (full volume) and
+# the detector response, stage 8 the patch features and the type / lobe
+# codes, stage 10 the risk columns. Unset floats are NaN, unset codes -1.
+CANDIDATE_DTYPE = np.dtype([
+    ("z", np.int32), ("y", np.int32), ("x", np.int32),
+    ("response", np.float32),
+    ("scale_diameter_mm", np.float64),
+    ("hu_mean", np.float64), ("hu_std", np.float64),
+    ("long_axis_mm", np.float64), ("volume_mm3", np.float64),
+    ("type", np.int8), ("lobe", np.int8),
+    ("prob_malignant", np.float64), ("confidence", np.float64),
+    ("entropy", np.float64), ("needs_review", np.bool_),
+])
+
+FEATURES = ("hu_mean", "hu_std", "long_axis_mm", "volume_mm3")
+
+def new_table(coords, response=None, scale_diameter_mm=None):
+    """Table from (N,3) z,y,x coordinates, optional per-row response / blob size."""
+    coords = np.asarray(coords).reshape(-1, 3)
+    table = np.zeros(len(coords), dtype=CANDIDATE_DTYPE)
+    for name in CANDIDATE_DTYPE.names:
+        if CANDIDATE_DTYPE[name].kind == "f":
+            table[name] = np.nan
+    table["type"] = table["lobe"] = -1
+    table["z"], table["y"], table["x"] = coords.T
+    if response is not None:
+        table["response"] = response
+    if scale_diameter_mm is not None:
+        table["scale_diameter_mm"] = scale_diameter_mm
+    return table
+
+def centers(table):
+    """(N,3) int32 z,y,x of the rows."""
+    return np.stack([table["z"], table["y"], table["x"]], axis=1)
@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.ndimage import gaussian_filter, maximum_filter
+
+def dog_sigmas(min_diameter_mm=3.0, max_diameter_mm=30.0, scales_per_octave=3, spacing=1.0):
+    """
+    Blur sigmas (voxels) of the pyramid. A 3-D blob of radius r answers
+    best at sigma = r / sqrt(3); one extra scale on each side so the first
+    and last sizes still get a scale-space maximum.
+    """
+    s_min = min_diameter_mm / (2.0 * np.sqrt(3.0)) / spacing
+    s_max = max_diameter_mm / (2.0 * np.sqrt(3.0)) / spacing
+    k = 2.0 ** (1.0 / scales_per_octave)
+    n = int(np.ceil(np.log(s_max / s_min) / np.log(k))) + 1
+    return s_min * k ** np.arange(-1, n + 2)
+
+def dog_candidates(volume, lung_mask, spacing=(1.0, 1.0, 1.0), min_diameter_mm=3.0,
+                   max_diameter_mm=30.0, scales_per_octave=3, threshold=0.02, top_k=None):
+    """
+    Multi-scale difference-of-Gaussians blob detector.
+    volume     - normalized CT volume (float32), isotropic
+    lung_mask  - binary mask of lungs (0/1)
+    Each blur is built from the previous one (sigma_k+1^2 = sigma_k^2 + d^2),
+    so the whole pyramid costs about one small-sigma filter per level.
+    D_k = (G_k - G_k+1) / (k - 1) approximates the scale-normalised -LoG at
+    sigma_k; a candidate is a maximum over its 3x3x3 neighbourhood in
+    space and over the neighbouring scales, above `threshold`, inside the lung.
+    Only three DoG levels are kept in memory at a time.
+    Returns (coords (N,3) int32, sigma, response), strongest first and at
+    most top_k: per candidate the blur sigma in voxels and the DoG
+    response. Estimated diameter = 2 * sqrt(3) * sigma * spacing.
+    """
+    sp = float(np.mean(spacing))
+    sigmas = dog_sigmas(min_diameter_mm, max_diameter_mm, scales_per_octave, sp)
+    k = sigmas[1] / sigmas[0]
+    inside = lung_mask > 0
+
+    # Apply inside lung only
+    masked = (volume * inside).astype(np.float32, copy=False)
+    blur = gaussian_filter(masked, sigmas[0])
+    del masked
+
+    peaks, peak_sigma, peak_resp = [], [], []
+    window = []  # [(level, D, 3x3x3 spatial max of D)] for three adjacent levels
+
+    def _scan(level):
+        # NMS across space and scale for the middle level of the window
+        (_, d_lo, m_lo), (_, d, m), (_, d_hi, m_hi) = window
+        keep = (d == m) & (d >= m_lo) & (d >= m_hi) & (d > threshold) & inside
+        idx = np.nonzero(keep)
+        peaks.append(np.stack(idx, axis=1))
+        peak_sigma.append(np.full(len(idx[0]), sigmas[level], dtype=np.float32))
+        peak_resp.append(d[idx])
+
+    for i in range(1, len(sigmas)):
+        step = np.sqrt(sigmas[i] ** 2 - sigmas[i - 1] ** 2)
+        nxt = gaussian_filter(blur, step)
+        blur -= nxt
+        blur /= (k - 1.0)
+        dog = blur
+        window.append((i - 1, dog, maximum_filter(dog, size=3)))
+        blur = nxt
+        if len(window) == 3:
+            _scan(window[1][0])
+            window.pop(0)
+
+    if peaks:
+        coords = np.concatenate(peaks)
+        sig = np.concatenate(peak_sigma)
+        resp = np.concatenate(peak_resp)
+    else:
+        coords = np.zeros((0, 3), dtype=np.int32)
+        sig = resp = np.zeros(0, dtype=np.float32)
+
+    # strongest first
+    if top_k is not None and resp.size > top_k:
+        part = np.argpartition(-resp, top_k - 1)[:top_k]
+        coords, sig, resp = coords[part], sig[part], resp[part]
+    order = np.argsort(-resp, kind="stable")
+    return coords[order].astype(np.int32), sig[order], resp[order]
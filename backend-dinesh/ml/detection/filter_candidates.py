@@ -1,22 +1,40 @@
 import numpy as np
+from scipy.spatial import cKDTree
 
-def filter_candidates(cands, volume, lung_mask, min_hu=-700, min_dist=3):
-    filtered = []
-    for (z,y,x) in cands:
-        # ignore outside lung
-        if lung_mask[z,y,x] == 0:
-            continue
-
-        # intensity check
-        if volume[z,y,x] < min_hu:  # too soft, not a solid nodule
-            continue
+def filter_candidates(cands, volume, lung_mask, min_hu=-700, min_dist=3, scores=None,
+                      return_index=False):
+    """
+    cands: (N,3) array or list of (z,y,x); scores: optional per-candidate
+    detector response. Candidates are visited strongest first (input order
+    without scores) and kept unless a kept candidate lies closer than
+    min_dist voxels. Returns the kept (z,y,x) tuples in visiting order, or
+    their row indices into cands with return_index=True.
+    """
+    pts = np.asarray(cands, dtype=np.intp).reshape(-1, 3)
+    if len(pts) == 0:
+        return np.zeros(0, dtype=np.intp) if return_index else []
 
-        # merge very close peaks
-        if filtered:
-            dist = np.min([np.linalg.norm(np.array([z,y,x]) - np.array(f)) for f in filtered])
-            if dist < min_dist:
-                continue
+    # ignore outside lung / too soft (not a solid nodule), all at once
+    z, y, x = pts.T
+    valid = (lung_mask[z, y, x] != 0) & (volume[z, y, x] >= min_hu)
+    idx = np.flatnonzero(valid)
+    if scores is not None:
+        idx = idx[np.argsort(-np.asarray(scores)[idx], kind="stable")]
+    pts = pts[idx]
+    if len(pts) == 0:
+        return np.zeros(0, dtype=np.intp) if return_index else []
 
-        filtered.append((z,y,x))
+    # greedy suppression of very close peaks; strict "< min_dist" like before
+    tree = cKDTree(pts)
+    radius = np.nextafter(float(min_dist), 0.0)
+    suppressed = np.zeros(len(pts), dtype=bool)
+    kept = []
+    for i in range(len(pts)):
+        if suppressed[i]:
+            continue
+        kept.append(i)
+        suppressed[tree.query_ball_point(pts[i], radius)] = True
 
-    return filtered
+    if return_index:
+        return idx[kept]
+    return [tuple(int(v) for v in p) for p in pts[kept]]
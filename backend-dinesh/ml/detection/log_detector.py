@@ -1,28 +1,191 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
 import numpy as np
 from scipy.ndimage import gaussian_laplace, maximum_filter
 
-def log_nodule_candidates(volume, lung_mask, sigma=1.0, threshold=0.001):
+def log_nodule_candidates(volume, lung_mask, sigma=1.0, threshold=0.001, inplace=False, response_dtype=None):
     """
     Detects spherical nodule candidates using 3D LoG filter + NMS.
     volume     - normalized CT volume (float32)
     lung_mask  - binary mask of lungs (0/1)
+    inplace    - zero `volume` outside the lung in place instead of copying it
+    response_dtype - dtype of the returned LoG response (e.g. float16 to keep less)
     """
     # Apply LoG inside lung only
-    masked = volume * (lung_mask > 0)
+    if inplace:
+        masked = volume
+        masked[lung_mask == 0] = 0
+    else:
+        masked = volume * (lung_mask > 0)
 
     # 3D Laplacian of Gaussian
-    log_response = -gaussian_laplace(masked, sigma=sigma)
+    log_response = gaussian_laplace(masked, sigma=sigma)
+    del masked
+    np.negative(log_response, out=log_response)
 
     # Normalize
-    log_response = (log_response - log_response.min()) / (log_response.max() - log_response.min() + 1e-5)
+    lo, hi = log_response.min(), log_response.max()
+    log_response -= lo
+    log_response /= (hi - lo + 1e-5)
 
     # Threshold to keep only high responses
-    candidates = (log_response > threshold)
-
     # Non-Maximum Suppression
-    local_max = maximum_filter(log_response, size=5) == log_response
-    peaks = np.where(candidates & local_max)
+    keep = maximum_filter(log_response, size=5) == log_response
+    keep &= log_response > threshold
+    peaks = np.nonzero(keep)
+    del keep
 
     # Return as list of (z,y,x)
     cand_list = list(zip(peaks[0], peaks[1], peaks[2]))
+    if response_dtype is not None:
+        log_response = log_response.astype(response_dtype, copy=False)
+    return cand_list, log_response
+
+
+# -------------------------------
+# Tiled, multi-threaded variant
+# -------------------------------
+NMS_SIZE = 5
+
+def _tiles(shape, tile):
+    """Core boxes (tuples of slices) covering the volume."""
+    starts = [range(0, n, t) for n, t in zip(shape, tile)]
+    return [tuple(slice(a, min(a + t, n)) for a, t, n in zip(corner, tile, shape))
+            for corner in product(*starts)]
+
+def _grow(box, halo, shape):
+    """Box grown by `halo` (clipped) + the core's position inside it."""
+    grown = tuple(slice(max(0, s.start - halo), min(n, s.stop + halo)) for s, n in zip(box, shape))
+    inner = tuple(slice(s.start - g.start, s.stop - g.start) for s, g in zip(box, grown))
+    return grown, inner
+
+def select_peaks(keep, response, top_k=None, labels=None, per_label_k=None):
+    """
+    Peak mask → (coords (N,3) int32, response values (N,)).
+    Uncapped, the peaks come in np.nonzero (C) order. per_label_k keeps
+    the strongest peaks of each nonzero label (e.g. each lung of the
+    lungmask labels; peaks outside the mask are dropped); top_k caps the
+    total. Caps use argpartition, and capped results are sorted strongest
+    first.
+    """
+    flat = np.flatnonzero(keep)
+    vals = response.ravel()[flat]
+    capped = False
+
+    if per_label_k is not None and labels is not None:
+        lab = labels.ravel()[flat]
+        sel = []
+        for value in np.unique(lab[lab > 0]):
+            idx = np.flatnonzero(lab == value)
+            if idx.size > per_label_k:
+                idx = idx[np.argpartition(-vals[idx], per_label_k - 1)[:per_label_k]]
+            sel.append(idx)
+        sel = np.concatenate(sel) if sel else np.zeros(0, dtype=np.intp)
+        flat, vals = flat[sel], vals[sel]
+        capped = True
+
+    if top_k is not None and flat.size > top_k:
+        part = np.argpartition(-vals, top_k - 1)[:top_k]
+        flat, vals = flat[part], vals[part]
+        capped = True
+
+    if capped:
+        order = np.argsort(-vals, kind="stable")
+        flat, vals = flat[order], vals[order]
+
+    coords = np.stack(np.unravel_index(flat, keep.shape), axis=1).astype(np.int32)
+    return coords, vals
+
+def log_nodule_peaks(volume, lung_mask, sigma=1.0, threshold=0.001, top_k=None, per_lung_k=None,
+                     tile=(64, 128, 128), threads=None, response_dtype=None, inplace=False):
+    """
+    Tiled, multi-threaded LoG (see log_nodule_candidates_tiled) returning
+    arrays instead of a list: (coords (N,3) int32, values (N,), log_response).
+    top_k / per_lung_k bound the candidate count (see select_peaks);
+    without them the peaks match log_nodule_candidates() one for one.
+    inplace - write the response into `volume` (z-slab by slab, keeping only
+    one slab of input) instead of allocating a second volume
+    """
+    shape = volume.shape
+    radius = int(4.0 * float(sigma) + 0.5)  # gaussian_laplace's default truncate=4
+    nms_r = NMS_SIZE // 2
+    boxes = _tiles(shape, tile)
+    threads = threads or min(32, os.cpu_count() or 1)
+
+    log_response = volume if inplace else np.empty(shape, dtype=volume.dtype)
+    zero = np.negative(np.zeros((), dtype=volume.dtype))  # what -LoG gives on all-zero input
+
+    def _filter(box, src=volume, z0=0):
+        # src holds the input from row z0 on
+        grown, inner = _grow(box, radius, shape)
+        m = lung_mask[grown] > 0
+        if not m.any():
+            log_response[box] = zero
+            return
+        zs = slice(grown[0].start - z0, grown[0].stop - z0)
+        masked = src[(zs,) + grown[1:]] * m
+        resp = gaussian_laplace(masked, sigma=sigma)
+        np.negative(resp, out=resp)
+        log_response[box] = resp[inner]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # list() re-raises the first error
+        if not inplace:
+            list(pool.map(_filter, boxes))
+        else:
+            slabs = {}
+            for box in boxes:
+                slabs.setdefault(box[0].start, []).append(box)
+            carry = volume[:0].copy()
+            for start in sorted(slabs):
+                end = slabs[start][0][0].stop
+                z0 = max(0, start - radius)
+                # rows below `start` were already overwritten: take them from the carry
+                src = np.concatenate([carry, volume[start:min(shape[0], end + radius)]])
+                carry = src[max(0, end - radius) - z0:end - z0].copy()
+                list(pool.map(lambda b: _filter(b, src, z0), slabs[start]))
+                del src
+
+        # Normalize (global, same arithmetic as the monolithic version)
+        lo, hi = log_response.min(), log_response.max()
+        log_response -= lo
+        log_response /= (hi - lo + 1e-5)
+
+        keep = np.empty(shape, dtype=bool)
+
+        def _nms(box):
+            grown, inner = _grow(box, nms_r, shape)
+            r = log_response[grown]
+            k = (maximum_filter(r, size=NMS_SIZE) == r)[inner]
+            k &= log_response[box] > threshold
+            keep[box] = k
+
+        list(pool.map(_nms, boxes))
+
+    coords, values = select_peaks(keep, log_response, top_k=top_k,
+                                  labels=lung_mask, per_label_k=per_lung_k)
+    del keep
+
+    if response_dtype is not None:
+        log_response = log_response.astype(response_dtype, copy=False)
+    return coords, values, log_response
+
+def log_nodule_candidates_tiled(volume, lung_mask, sigma=1.0, threshold=0.001,
+                                tile=(64, 128, 128), threads=None, response_dtype=None):
+    """
+    Same candidates and response as log_nodule_candidates(), computed per
+    tile on a thread pool (scipy.ndimage releases the GIL).
+    Pass 1 filters each tile with a halo of the Gaussian radius and writes
+    its core into the response; the global min/max normalisation runs on
+    the assembled response; pass 2 runs the 5x5x5 NMS per tile with a halo
+    of 2 into one boolean peak mask. Tiles whose haloed input is all
+    outside the lung are not filtered (their response is exactly zero).
+    volume must be floating point (the normalised CT).
+    """
+    coords, _, log_response = log_nodule_peaks(volume, lung_mask, sigma, threshold, tile=tile,
+                                               threads=threads, response_dtype=response_dtype)
+    # Return as list of (z,y,x)
+    cand_list = list(zip(*coords.astype(np.int64).T))
     return cand_list, log_response
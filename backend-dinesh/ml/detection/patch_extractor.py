@@ -10,3 +10,52 @@ def extract_patch(volume, center, size=32):
 
     patch = volume[z1:z2, y1:y2, x1:x2]
     return patch
+
+def patch_buffer(n, size=32, dtype=np.int16, buf=None):
+    """
+    Reusable patch buffer: `buf` itself when it holds at least n patches of
+    this size and type, otherwise a new one with some headroom. Pass
+    buf[:n] as `out` to extract_patches (e.g. once per chunk of candidates).
+    """
+    shape = (size, size, size)
+    if buf is None or buf.dtype != np.dtype(dtype) or buf.shape[1:] != shape or len(buf) < n:
+        buf = np.empty((max(n, int(n * 1.25)),) + shape, dtype=dtype)
+    return buf
+
+def extract_patches(volume, centers, size=32, fill=-1024, out=None):
+    """
+    Batched extract_patch: one contiguous (N,size,size,size) array.
+    Patch i covers centers[i] - size//2 .. centers[i] + size//2 - 1 on
+    every axis; voxels outside the volume are `fill` (air), so edge
+    patches keep the full size instead of being truncated.
+    out: optional buffer of that shape (see patch_buffer) written in place.
+    """
+    centers = np.asarray(centers, dtype=np.intp).reshape(-1, 3)
+    n, half = len(centers), size // 2
+    if out is None:
+        out = np.empty((n, size, size, size), dtype=volume.dtype)
+    elif out.shape != (n, size, size, size):
+        raise ValueError(f"out has shape {out.shape}, expected {(n, size, size, size)}")
+    if n == 0:
+        return out
+
+    lo = centers - half
+    hi = lo + size
+    shape = np.asarray(volume.shape)
+    inside = np.all((lo >= 0) & (hi <= shape), axis=1)
+
+    # one block copy per patch (faster than a fancy-index gather of windows);
+    # edge patches are filled first, then get the part inside the volume
+    for i, (z, y, x) in enumerate(lo.tolist()):
+        if inside[i]:
+            out[i] = volume[z:z + size, y:y + size, x:x + size]
+            continue
+        src_lo = np.maximum(lo[i], 0)
+        src_hi = np.minimum(hi[i], shape)
+        dst_lo = src_lo - lo[i]
+        dst_hi = dst_lo + (src_hi - src_lo)
+        out[i] = fill
+        if np.all(src_hi > src_lo):
+            out[i, dst_lo[0]:dst_hi[0], dst_lo[1]:dst_hi[1], dst_lo[2]:dst_hi[2]] = \
+                volume[src_lo[0]:src_hi[0], src_lo[1]:src_hi[1], src_lo[2]:src_hi[2]]
+    return out
@@ -1,48 +1,42 @@
 import numpy as np
-from sklearn.cluster import DBSCAN
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
-def smart_filter(filtered_centers, features):
+def cluster_radius(coords, eps=10.0):
     """
-    filtered_centers: list of (z,y,x)
-    features: list of dicts [{hu_mean, long_axis_mm, volume_mm3, ...}]
+    Connected components of the radius graph (pairs at distance <= eps);
+    same clusters as DBSCAN(eps, min_samples=1). Labels are numbered in
+    order of each cluster's first member.
     """
-
-    # Stage 1 — remove air/noise
-    cand = []
-    for c, f in zip(filtered_centers, features):
-        if f["hu_mean"] > -800:   # keep only real tissue
-            cand.append((c, f))
-
-    if not cand:
-        return [], []
-
-    centers = [c for c, f in cand]
-    feats   = [f for c, f in cand]
-
+    n = len(coords)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    pairs = cKDTree(coords).query_pairs(eps, output_type="ndarray")
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    # renumber by first occurrence
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+    return rank[inverse]
+
+def smart_filter(candidates):
+    """
+    candidates: candidate table (see candidate_table.py) with the patch
+    features filled in. Returns the rows kept, in cluster order.
+    """
+    # Stage 1 — remove air/noise (keep only real tissue)
     # Stage 2 — remove tiny candidates (<4 mm)
-    cand2_centers = []
-    cand2_feats   = []
-    for c, f in zip(centers, feats):
-        if f["long_axis_mm"] >= 4:
-            cand2_centers.append(c)
-            cand2_feats.append(f)
-
-    if not cand2_centers:
-        return [], []
-
-    # Stage 3 — cluster to remove duplicates
-    coords = np.array(cand2_centers)
-    clustering = DBSCAN(eps=10, min_samples=1).fit(coords)  # 10 mm
-    labels = clustering.labels_
-
-    final_centers = []
-    final_feats   = []
-
-    for lab in np.unique(labels):
-        idxs = np.where(labels == lab)[0]
-        # choose the candidate with highest hu_mean (most solid)
-        best_idx = max(idxs, key=lambda i: cand2_feats[i]["hu_mean"])
-        final_centers.append(cand2_centers[best_idx])
-        final_feats.append(cand2_feats[best_idx])
-
-    return final_centers, final_feats
+    cand = candidates[(candidates["hu_mean"] > -800) & (candidates["long_axis_mm"] >= 4)]
+    if len(cand) == 0:
+        return cand
+
+    # Stage 3 — cluster to remove duplicates (10 mm)
+    coords = np.stack([cand["z"], cand["y"], cand["x"]], axis=1).astype(np.float64)
+    labels = cluster_radius(coords, eps=10)
+
+    # choose the candidate with highest hu_mean (most solid); first one on ties
+    order = np.lexsort((np.arange(len(cand)), -cand["hu_mean"], labels))
+    best = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+    return cand[best]
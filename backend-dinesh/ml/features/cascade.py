@@ -0,0 +1,131 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+_spec = importlib.util.spec_from_file_location(
+    "feature_extractor", str(Path(__file__).resolve().parent / "feature_extractor.py"))
+feature_extractor = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(feature_extractor)
+
+# Feature groups: declared cost per candidate (relative units) and the
+# columns each one produces. A group is computed once, when the first gate
+# needs it, and only for the candidates still alive at that point.
+# "detector" columns come with the candidates (passed to run_cascade) and
+# cost nothing; they are NaN when the detector gives no value (LoG has no
+# scale), and a NaN passes the gates that read it.
+FEATURE_GROUPS = {
+    "detector": (0, ("scale_diameter_mm",)),
+    "center": (1, ("center_hu",)),
+    "stats": (10, ("hu_mean", "hu_std", "voxel_count")),
+    "shape": (100, ("long_axis_mm", "volume_mm3")),
+}
+
+# The pipeline's own rules, so the default cascade only drops candidates
+# that a later stage would drop anyway (same findings, less work).
+DEFAULT_GATES = (
+    {"name": "center_hu", "feature": "center_hu", "op": ">=", "value": -700},       # filter_candidates min_hu
+    {"name": "hu_mean", "feature": "hu_mean", "op": ">", "value": -800},            # smart_filter stage 1
+    {"name": "voxel_count", "feature": "voxel_count", "op": ">=", "value": 5},      # fewer: long axis is 0 (any mask)
+    {"name": "long_axis_mm", "feature": "long_axis_mm", "op": ">=", "value": 4},    # smart_filter stage 2
+)
+
+_OPS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+
+def _group(feature):
+    for name, (_, cols) in FEATURE_GROUPS.items():
+        if feature in cols:
+            return name
+    raise ValueError(f"Unknown cascade feature: {feature}")
+
+def gate_cost(gate):
+    """A gate's declared cost, or the cost of the feature group it reads."""
+    return gate.get("cost", FEATURE_GROUPS[_group(gate["feature"])][0])
+
+def run_cascade(patches, gates=DEFAULT_GATES, spacing=(1.0, 1.0, 1.0), chunk=64, segment=True,
+                columns=None):
+    """
+    Cheap-to-expensive rejection over an (N,Z,Y,X) HU patch batch (patch
+    centers at index size//2, see extract_patches). Gates run in order of
+    cost (stable); a candidate stops at the first gate it fails.
+    segment: shape features (long axis, volume) from the central connected
+    component of each patch's tissue voxels (above -700 HU, see
+    batch_mask_shape) instead of the whole threshold mask.
+    gates: [{"name", "feature", "op" (> >= < <=), "value"[, "cost"]}]
+    columns: per-candidate "detector" values, e.g. {"scale_diameter_mm": (N,)}
+    Returns (keep, features, report):
+      keep     - indices of the surviving patches
+      features - every computed FEATURE_GROUPS column for the survivors
+      report   - [{"name", "cost", "tested", "rejected"}] in run order
+    """
+    n = len(patches)
+    cols = {}
+    done = set()
+
+    def _compute(group, rows):
+        # fills the group's columns at `rows` (NaN elsewhere)
+        if group == "detector":
+            values = {name: np.asarray(columns[name], dtype=np.float64)[rows] if columns and name in columns
+                      else np.nan for name in FEATURE_GROUPS["detector"][1]}
+        elif group == "center":
+            c = tuple(s // 2 for s in patches.shape[1:])
+            values = {"center_hu": patches[(rows,) + c].astype(np.float64)}
+        elif group == "stats":
+            values = feature_extractor.batch_hu_stats(patches, chunk, rows=rows)
+        else:
+            if "stats" not in done:
+                _compute("stats", rows)     # the mask threshold comes from there
+            values = feature_extractor.batch_mask_shape(
+                patches, cols["mask_threshold"][rows], spacing=spacing, chunk=chunk, rows=rows,
+                segment=segment)
+        for name, v in values.items():
+            cols.setdefault(name, np.full(n, np.nan))[rows] = v
+        done.add(group)
+
+    alive = np.arange(n)
+    report = []
+    for gate in sorted(gates, key=gate_cost):
+        group = _group(gate["feature"])
+        if group not in done:
+            _compute(group, alive)
+        v = cols[gate["feature"]][alive]
+        ok = _OPS[gate["op"]](v, gate["value"])
+        if group == "detector":
+            ok |= np.isnan(v)
+        report.append({"name": gate["name"], "cost": gate_cost(gate),
+                       "tested": int(len(alive)), "rejected": int(len(alive) - np.count_nonzero(ok))})
+        alive = alive[ok]
+
+    # survivors get every feature; the long axis reads the stats threshold
+    for group in FEATURE_GROUPS:
+        if group not in done and group != "detector":
+            _compute(group, alive)
+    skip = {"mask_threshold", *FEATURE_GROUPS["detector"][1]}
+    features = {name: col[alive] for name, col in cols.items() if name not in skip}
+    return alive, features, report
+
+def run_cascade_chunks(get_patches, n, gates=DEFAULT_GATES, spacing=(1.0, 1.0, 1.0), chunk=64,
+                       segment=True, columns=None):
+    """
+    run_cascade over n candidates, `chunk` at a time, so only one chunk of
+    patches exists at once. get_patches(a, b) returns the patches of
+    candidates a..b-1 (it may reuse one buffer). Same results as one
+    run_cascade call over all the patches; the report counts are summed.
+    """
+    keep, features, report = [], {}, []
+    for a in range(0, n, chunk) or [0]:
+        b = min(a + chunk, n)
+        part = {name: np.asarray(v)[a:b] for name, v in columns.items()} if columns else None
+        k, f, r = run_cascade(get_patches(a, b), gates, spacing=spacing, chunk=chunk,
+                              segment=segment, columns=part)
+        keep.append(k + a)
+        for name, v in f.items():
+            features.setdefault(name, []).append(v)
+        if not report:
+            report = r
+        else:
+            for total, g in zip(report, r):
+                total["tested"] += g["tested"]
+                total["rejected"] += g["rejected"]
+    features = {name: np.concatenate(v) for name, v in features.items()}
+    return np.concatenate(keep), features, report
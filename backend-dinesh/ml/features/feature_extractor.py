@@ -51,6 +51,7 @@ def extract_patch_features(patch, spacing=[1.0,1.0,1.0]):
         "mask": mask
     }
 import numpy as np
+from scipy import ndimage
 from sklearn.decomposition import PCA
 
 def compute_hu_stats(patch, lung_threshold=-950):
@@ -144,4 +145,213 @@ def extract_patch_features(patch, spacing, mask=None):
         "hu_std": float(hu_std),
         "long_axis_mm": float(long_axis_mm),
         "volume_mm3": float(volume_mm3)
-    }
\ No newline at end of file
+    }
+# ---------------------------
+# Batched features over (N,Z,Y,X) patches
+# ---------------------------
+def _batch_moments(fg, spacing):
+    """Voxel counts, centroids (mm) and 3x3 coordinate covariances of (n,Z,Y,X) masks."""
+    z, y, x = (np.arange(n, dtype=np.float64) * s for n, s in zip(fg.shape[1:], spacing))
+    # 2-D marginals carry every first and second moment
+    m_zy = fg.sum(axis=3, dtype=np.int32).astype(np.float64)
+    m_zx = fg.sum(axis=2, dtype=np.int32).astype(np.float64)
+    m_yx = fg.sum(axis=1, dtype=np.int32).astype(np.float64)
+    m_z, m_y, m_x = m_zy.sum(axis=2), m_zy.sum(axis=1), m_zx.sum(axis=1)
+    count = m_z.sum(axis=1)
+
+    n = np.maximum(count, 1.0)
+    mean = np.stack([m_z @ z, m_y @ y, m_x @ x], axis=1) / n[:, None]
+    second = np.empty((len(fg), 3, 3))
+    second[:, 0, 0] = m_z @ (z * z)
+    second[:, 1, 1] = m_y @ (y * y)
+    second[:, 2, 2] = m_x @ (x * x)
+    second[:, 0, 1] = second[:, 1, 0] = np.einsum("nab,a,b->n", m_zy, z, y)
+    second[:, 0, 2] = second[:, 2, 0] = np.einsum("nab,a,b->n", m_zx, z, x)
+    second[:, 1, 2] = second[:, 2, 1] = np.einsum("nab,a,b->n", m_yx, y, x)
+    cov = second / n[:, None, None] - mean[:, :, None] * mean[:, None, :]
+    return count, mean, cov
+
+def batch_long_axis_mm(fg, spacing):
+    """
+    Batched compute_long_axis_mm_from_mask: extent of each mask along the
+    leading eigenvector of its coordinate covariance (the first PCA
+    component). Masks with fewer than 5 voxels get 0.
+    """
+    count, _, cov = _batch_moments(fg, spacing)
+    _, vecs = np.linalg.eigh(cov)
+    axis = vecs[:, :, -1]                       # eigenvalues ascending
+
+    # along x the projection is monotonic, so per (z,y) row only its first or
+    # last voxel can hold the extreme: (n,Z,Y) work instead of (n,Z,Y,X)
+    nx = fg.shape[3]
+    z, y, x = (np.arange(n, dtype=np.float64) * s for n, s in zip(fg.shape[1:], spacing))
+    row = fg.any(axis=3)
+    x_first = x[fg.argmax(axis=3)]
+    x_last = x[nx - 1 - fg[..., ::-1].argmax(axis=3)]
+    zy = axis[:, 0, None, None] * z[None, :, None] + axis[:, 1, None, None] * y[None, None, :]
+    a_x = axis[:, 2, None, None]
+    hi = zy + a_x * np.where(a_x >= 0, x_last, x_first)
+    lo = zy + a_x * np.where(a_x >= 0, x_first, x_last)
+    hi = np.where(row, hi, -np.inf).max(axis=(1, 2))
+    lo = np.where(row, lo, np.inf).min(axis=(1, 2))
+    return np.where(count >= 5, hi - lo, 0.0)
+
+def _row_mean_std(vals, k):
+    mean = vals.sum(axis=1) / k
+    var = np.einsum("ij,ij->i", vals, vals) / k - mean * mean
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+def _nodule_mask(p, threshold):
+    # use conservative threshold to identify nodule tissue
+    return (p > -950) & (p > threshold[:, None])
+
+def _chunk(patches, rows, a, b):
+    # patches a..b of the batch, or of its `rows` subset
+    return patches[a:b] if rows is None else patches[rows[a:b]]
+
+def batch_hu_stats(patches, chunk=64, rows=None):
+    """
+    Cheap pass over an (N,Z,Y,X) HU batch: HU mean/std above -950 (whole
+    patch if none), the adaptive mask threshold (patch mean - 1.5 std) and
+    the mask's voxel count. Moments come from float64 dot products (exact
+    for integer HU). rows: only these patches (outputs follow rows).
+    Returns a dict of columns.
+    """
+    n = len(patches) if rows is None else len(rows)
+    out = {"hu_mean": np.zeros(n), "hu_std": np.zeros(n),
+           "mask_threshold": np.zeros(n), "voxel_count": np.zeros(n, dtype=np.int64)}
+    for a in range(0, n, chunk):
+        b = min(a + chunk, n)
+        p = _chunk(patches, rows, a, b).reshape(b - a, -1)
+        v = p.astype(np.float64)
+
+        # HU stats of the non-air voxels (whole patch if there are none)
+        tissue = p > -950
+        k = np.count_nonzero(tissue, axis=1)
+        mu, sd = _row_mean_std(v, p.shape[1])
+        mean, std = _row_mean_std(v * tissue, np.maximum(k, 1))
+        out["hu_mean"][a:b] = np.where(k > 0, mean, mu)
+        out["hu_std"][a:b] = np.where(k > 0, std, sd)
+
+        thr = mu - 1.5 * sd
+        out["mask_threshold"][a:b] = thr
+        out["voxel_count"][a:b] = np.count_nonzero(tissue & (p > thr[:, None]), axis=1)
+    return out
+
+def batch_nodule_masks(fg):
+    """
+    Keeps, in each (n,Z,Y,X) mask, only the connected component (face
+    connectivity) that contains the patch center, or else the one with the
+    voxel nearest to it; vessels and chest wall that merely touch the patch
+    drop out. All patches are labelled in one ndimage.label pass, stacked
+    along z with an empty separator slice between them.
+    """
+    n, nz, ny, nx = fg.shape
+    stack = np.zeros((n, nz + 1, ny, nx), dtype=bool)
+    stack[:, :nz] = fg
+    lab, _ = ndimage.label(stack.reshape(n * (nz + 1), ny, nx))
+    lab = lab.reshape(n, nz + 1, ny, nx)[:, :nz]
+
+    c = (nz // 2, ny // 2, nx // 2)
+    chosen = lab[:, c[0], c[1], c[2]].copy()
+    miss = np.flatnonzero((chosen == 0) & fg.reshape(n, -1).any(axis=1))
+    if miss.size:
+        # nearest foreground voxel to the center: first hit in distance order
+        z, y, x = np.ogrid[:nz, :ny, :nx]
+        d2 = ((z - c[0]) ** 2 + (y - c[1]) ** 2 + (x - c[2]) ** 2).ravel()
+        order = np.argsort(d2, kind="stable")
+        flat = fg.reshape(n, -1)
+        nearest = np.zeros(len(miss), dtype=np.intp)
+        todo = np.arange(len(miss))
+        # the ball of radius 4 first (anything outside it is farther), then everything
+        for k in (np.searchsorted(d2[order], 16, side="right"), len(order)):
+            hits = flat[miss[todo][:, None], order[:k]]
+            found = hits.any(axis=1)
+            nearest[todo[found]] = order[hits[found].argmax(axis=1)]
+            todo = todo[~found]
+            if todo.size == 0:
+                break
+        chosen[miss] = lab.reshape(n, -1)[miss, nearest]
+    return (lab == chosen[:, None, None, None]) & (chosen > 0)[:, None, None, None]
+
+# balls of this radius (voxels) do not fit in the vessels the opening cuts off
+VESSEL_OPEN_RADIUS = 3
+
+def _ball(r):
+    z, y, x = np.ogrid[-r:r + 1, -r:r + 1, -r:r + 1]
+    return z * z + y * y + x * x <= r * r
+
+def batch_detach_vessels(fg, radius=VESSEL_OPEN_RADIUS):
+    """
+    Opens each (n,Z,Y,X) component mask with a ball of `radius` voxels and
+    keeps the central component of the result: vessels attached to a nodule
+    drop out, the nodule keeps its shape. A mask whose center does not
+    survive the opening (nothing there as thick as the ball) is kept as is.
+    """
+    ball = _ball(radius)[None]
+    c = tuple(s // 2 for s in fg.shape[1:])
+    # the center survives iff a ball within `radius` of it fits in the mask:
+    # decided on the (4r+1)^3 window around it before opening whole patches
+    win = fg[(slice(None),) + tuple(slice(k - 2 * radius, k + 2 * radius + 1) for k in c)]
+    inner = (slice(None),) + (slice(radius, 3 * radius + 1),) * 3
+    has = (ndimage.binary_erosion(win, structure=ball)[inner] & ball).any(axis=(1, 2, 3))
+    out = fg.copy()
+    if has.any():
+        out[has] = batch_nodule_masks(ndimage.binary_opening(fg[has], structure=ball))
+    return out
+
+# solid / part-solid tissue: the lung parenchyma (about -850 HU) stays
+# below it, ground glass (-700..-300) above; same cut as filter_candidates
+TISSUE_HU = -700
+
+def batch_mask_shape(patches, threshold=None, masks=None, spacing=(1.0, 1.0, 1.0),
+                     chunk=64, rows=None, segment=False, tissue_hu=TISSUE_HU):
+    """
+    Costly pass: PCA long axis (mm) and volume (mm3) of each patch's nodule
+    mask, given either the per-patch `threshold` from batch_hu_stats or
+    explicit `masks` (both aligned with rows when given). segment=True
+    measures the central component (batch_nodule_masks) of the mask's
+    voxels above tissue_hu instead: the adaptive threshold alone keeps most
+    of the lung, so its central component is the whole patch. Components
+    much longer than a sphere of their volume are re-measured without the
+    vessels attached to them (batch_detach_vessels).
+    """
+    n = len(patches) if rows is None else len(rows)
+    out = {"long_axis_mm": np.zeros(n), "volume_mm3": np.zeros(n)}
+    voxel_vol = float(spacing[0] * spacing[1] * spacing[2])
+    for a in range(0, n, chunk):
+        b = min(a + chunk, n)
+        if masks is None:
+            p = _chunk(patches, rows, a, b)
+            fg = _nodule_mask(p.reshape(b - a, -1), threshold[a:b]).reshape(p.shape)
+            if segment:
+                fg &= p > tissue_hu
+        else:
+            fg = masks[a:b].astype(bool, copy=False)
+        if segment:
+            fg = batch_nodule_masks(fg)
+        long_axis = batch_long_axis_mm(fg, spacing)
+        volume = np.count_nonzero(fg.reshape(b - a, -1), axis=1) * voxel_vol
+        if segment:
+            # elongated: a vessel runs into or through the component
+            sel = np.flatnonzero(long_axis > 1.5 * np.cbrt(6.0 * volume / np.pi))
+            if sel.size:
+                sub = batch_detach_vessels(fg[sel])
+                long_axis[sel] = batch_long_axis_mm(sub, spacing)
+                volume[sel] = np.count_nonzero(sub.reshape(len(sel), -1), axis=1) * voxel_vol
+        out["long_axis_mm"][a:b] = long_axis
+        out["volume_mm3"][a:b] = volume
+    return out
+
+def batch_patch_features(patches, spacing=(1.0, 1.0, 1.0), masks=None, chunk=64, segment=False):
+    """
+    Batched extract_patch_features over an (N,Z,Y,X) HU array:
+    batch_hu_stats, then batch_mask_shape (segment=True measures only the
+    central connected component of each mask's tissue voxels).
+    `masks` (N,Z,Y,X) replaces the adaptive threshold mask.
+    `chunk` patches at a time bound the temporaries.
+    Returns a dict of (N,) float64 columns: hu_mean, hu_std, long_axis_mm, volume_mm3.
+    """
+    stats = batch_hu_stats(patches, chunk)
+    shape = batch_mask_shape(patches, stats["mask_threshold"], masks, spacing, chunk, segment=segment)
+    return {"hu_mean": stats["hu_mean"], "hu_std": stats["hu_std"], **shape}
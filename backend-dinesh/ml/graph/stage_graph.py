@@ -0,0 +1,114 @@
+# backend-dinesh/ml/graph/stage_graph.py
+#
+# Tiny dependency-graph executor for the pipeline stages.
+#
+# Each stage names the values it reads and the values it produces. A stage
+# starts as soon as all of its inputs exist, so independent stages (e.g.
+# the volume store and HU normalisation once the lungs are cropped, or the
+# lung-health metrics and detection through the per-nodule risk loop) run
+# side by side on a thread pool. numpy / scipy /
+# SimpleITK / torch release the GIL, so this is real parallelism.
+# Every value is reference-counted by its remaining consumers and dropped
+# as soon as the last one finishes, which keeps peak memory down.
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Stage:
+    def __init__(self, name, fn, inputs=(), outputs=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+
+class StageGraph:
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, fn, inputs=(), outputs=()):
+        """fn(**inputs) returns one value per output name (a tuple if several)."""
+        self.stages.append(Stage(name, fn, inputs, outputs))
+        return self
+
+    def _check(self, initial):
+        produced = set(initial)
+        for st in self.stages:
+            for out in st.outputs:
+                if out in produced:
+                    raise ValueError(f"Value '{out}' is produced twice (stage {st.name})")
+                produced.add(out)
+        for st in self.stages:
+            missing = [i for i in st.inputs if i not in produced]
+            if missing:
+                raise ValueError(f"Stage {st.name} needs unknown inputs: {missing}")
+
+    def run(self, initial=None, keep=(), max_workers=2):
+        """
+        Runs all stages and returns {name: value} for the names in `keep`.
+        Intermediate values not in `keep` are released once no pending
+        stage reads them.
+        """
+        values = dict(initial or {})
+        keep = set(keep)
+        self._check(values)
+
+        # remaining consumers per value
+        refs = {}
+        for st in self.stages:
+            for i in st.inputs:
+                refs[i] = refs.get(i, 0) + 1
+
+        def release(name):
+            if name not in keep and refs.get(name, 0) == 0:
+                values.pop(name, None)
+
+        for name in list(values):
+            release(name)
+
+        pending = list(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+            try:
+                while pending or running:
+                    # submit everything that is ready, in declaration order
+                    for st in list(pending):
+                        if all(i in values for i in st.inputs):
+                            kwargs = {i: values[i] for i in st.inputs}
+                            running[pool.submit(st.fn, **kwargs)] = st
+                            pending.remove(st)
+                            del kwargs
+
+                    if not running:
+                        raise RuntimeError(
+                            "Stage graph stalled: " + ", ".join(st.name for st in pending))
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        st = running.pop(fut)
+                        result = fut.result()
+                        del fut
+
+                        if len(st.outputs) == 1:
+                            result = (result,)
+                        elif len(st.outputs) == 0:
+                            result = ()
+                        for name, val in zip(st.outputs, result):
+                            values[name] = val
+                        del result
+
+                        for name in st.outputs:
+                            release(name)
+                        for i in st.inputs:
+                            refs[i] -= 1
+                            release(i)
+                    # futures keep their results alive; drop them now
+                    del done
+            except BaseException:
+                for fut in running:
+                    fut.cancel()
+                raise
+
+        return {k: values[k] for k in keep if k in values}
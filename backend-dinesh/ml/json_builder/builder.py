@@ -1,89 +1,100 @@
 # backend-dinesh/ml/json_builder/builder.py
 import json
+from contextlib import nullcontext
 from datetime import datetime
 import numpy as np
 
-def compute_lung_health_metrics(volume, spacing):
+def compute_lung_health_metrics(volume, spacing, total_voxels=None):
     """
     Simple estimators:
     - emphysema_score = % voxels < -950 HU inside lung
     - consolidation_score = % voxels > -200 HU inside lung
     - fibrosis_score = texture roughness proxy (std of Laplacian) normalized
+    total_voxels: size of the full masked volume when `volume` is a crop of
+    it; the voxels outside the crop count as zeros (same scores, fewer voxels).
     """
     # volume: full resampled CT numpy array (Z,Y,X) if provided; spacing used for voxel volume
     # This function assumes you pass a masked lung volume; if None, return zeros
     if volume is None:
         return 0.0, 0.0, 0.0
     try:
-        pct_emphy = float(np.mean(volume < -950))
-        pct_cons = float(np.mean(volume > -200))
+        n = int(total_voxels) if total_voxels is not None else volume.size
+        n_pad = n - volume.size  # zero voxels outside the crop
+        pct_emphy = float(np.count_nonzero(volume < -950) / n)
+        pct_cons = float((np.count_nonzero(volume > -200) + n_pad) / n)
         # rough proxy for fibrosis: normalized std of Laplacian
         from scipy import ndimage
         lap = ndimage.laplace(volume.astype(np.float32))
-        fibrosis_proxy = float(np.clip(np.std(lap) / (abs(np.mean(volume)) + 1e-6), 0.0, 1.0))
+        lap_mean = lap.sum(dtype=np.float64) / n
+        lap -= lap_mean
+        lap_std = np.sqrt((np.square(lap, dtype=np.float64).sum() + n_pad * lap_mean**2) / n)
+        vol_mean = volume.sum(dtype=np.float64) / n
+        fibrosis_proxy = float(np.clip(lap_std / (abs(vol_mean) + 1e-6), 0.0, 1.0))
         return pct_emphy, fibrosis_proxy, pct_cons
     except Exception:
         return 0.0, 0.0, 0.0
 
-def build_findings_json(study_id, spacing, volume_shape,
-                        filtered_candidates, features,
-                        malignancy_scores, uncertainties,
+def build_findings_json(study_id, spacing, volume_shape, candidates,
                         output_path, processing_time_seconds=None,
-                        lung_volume_for_metrics=None):
+                        lung_volume_for_metrics=None, profiler=None,
+                        lung_metrics=None, volume_path=None,
+                        type_names=(), lobe_names=(), bbox_half=16):
     """
-    filtered_candidates: list of centers [(z,y,x),...]
-    features: list of dicts aligned with filtered_candidates
-    malignancy_scores: list aligned
-    uncertainties: list aligned
+    candidates: candidate table (see ml/detection/candidate_table.py) of the
+        final nodules, features and risk columns filled in
+    type_names / lobe_names: labels of the table's type / lobe codes
+    bbox_half: half the feature patch size; bbox = center - half .. center + half - 1,
+        clipped to volume_shape (edge patches are padded with air past the scan)
     lung_volume_for_metrics: optional numpy array (masked lung) to compute lung-level metrics
+    lung_metrics: optional precomputed (emphysema, fibrosis, consolidation); skips the computation
+    profiler: optional StageProfiler; its summary goes into the "profiling" block
+    volume_path: optional .ctvol volume store of this study (metadata.volume_store)
+    output_path: where to write the JSON; None skips writing
+    returns the findings dict
     """
-        # ---------------------------------------
-    # Standardize Python types for JSON
-    # ---------------------------------------
-    def py(v):
-        """Convert numpy types to plain Python types."""
-        if isinstance(v, (np.int32, np.int64)):
-            return int(v)
-        if isinstance(v, (np.float32, np.float64)):
-            return float(v)
-        if isinstance(v, np.ndarray):
-            return v.tolist()
-        return v
+    def label(names, code):
+        return names[code] if 0 <= code < len(names) else "unknown"
 
     nodules = []
-    for i, (center, ft, p, unc) in enumerate(zip(filtered_candidates, features, malignancy_scores, uncertainties)):
-        cz, cy, cx = [py(c) for c in center]
+    # one conversion to plain Python types for JSON
+    for i, row in enumerate(candidates.tolist()):
+        ft = dict(zip(candidates.dtype.names, row))
+        cz, cy, cx = ft["z"], ft["y"], ft["x"]
+        lobe = label(lobe_names, ft["lobe"])
+        box = [[max(0, c - bbox_half), min(n, c + bbox_half) - 1]
+               for c, n in zip((cz, cy, cx), volume_shape)]
 
-        bbox = ft.get("bbox", None)
-        if bbox:
-            bbox = {
-                "z": [py(bbox["z"][0]), py(bbox["z"][1])],
-                "y": [py(bbox["y"][0]), py(bbox["y"][1])],
-                "x": [py(bbox["x"][0]), py(bbox["x"][1])]
-            }
-
-        nodules.append({
+        nodule = {
             "id": int(i),
             "centroid": [cz, cy, cx],
             "coordinates": [cz, cy, cx],
-            "bbox": bbox,
+            "bbox": {"z": box[0], "y": box[1], "x": box[2]},
             "mask_path": None,  # mask saved later in Phase-2 (optional)
-            "long_axis_mm": py(ft.get("long_axis_mm", 0.0)),
-            "volume_mm3": py(ft.get("volume_mm3", 0.0)),
-            "type": ft.get("type", "unknown"),
-            "lobe": ft.get("lobe", "unknown"),
-            "location": ft.get("lobe", "unknown"),
-            "prob_malignant": py(p),
+            "long_axis_mm": ft["long_axis_mm"],
+            "volume_mm3": ft["volume_mm3"],
+            "type": label(type_names, ft["type"]),
+            "lobe": lobe,
+            "location": lobe,
+            "prob_malignant": ft["prob_malignant"],
             "uncertainty": {
-                "confidence": py(unc.get("confidence", 0.0)),
-                "entropy": py(unc.get("entropy", 0.0)),
-                "needs_review": bool(unc.get("needs_review", False))
+                "confidence": ft["confidence"],
+                "entropy": ft["entropy"],
+                "needs_review": ft["needs_review"]
             }
-        })
+        }
+        # blob size from a multi-scale detector (DoG), when there is one
+        if not np.isnan(ft["scale_diameter_mm"]):
+            nodule["scale_diameter_mm"] = ft["scale_diameter_mm"]
+        nodules.append(nodule)
 
 
     # lung-level metrics
-    emphysema_score, fibrosis_score, consolidation_score = compute_lung_health_metrics(lung_volume_for_metrics, spacing) if lung_volume_for_metrics is not None else (0.0, 0.0, 0.0)
+    if lung_metrics is not None:
+        emphysema_score, fibrosis_score, consolidation_score = lung_metrics
+    else:
+        stage = profiler.stage("12_lung_health_metrics", volume=lung_volume_for_metrics) if profiler is not None else nullcontext()
+        with stage:
+            emphysema_score, fibrosis_score, consolidation_score = compute_lung_health_metrics(lung_volume_for_metrics, spacing) if lung_volume_for_metrics is not None else (0.0, 0.0, 0.0)
     lung_health_text = "Lungs appear within expected attenuation ranges." if emphysema_score < 0.05 else "Findings suggest increased low attenuation areas consistent with emphysema."
 
     largest = 0.0
@@ -107,7 +118,7 @@ def build_findings_json(study_id, spacing, volume_shape,
             "volume_shape": list(map(int, volume_shape)),
             "spacing": [float(s) for s in spacing]
         },
-        "num_candidates": int(len(filtered_candidates) if filtered_candidates is not None else 0),
+        "num_candidates": int(len(candidates)),
         "num_nodules": int(len(nodules)),
         "processing_time_seconds": float(processing_time_seconds) if processing_time_seconds is not None else 0.0,
         "lung_health": lung_health_text,
@@ -120,6 +131,15 @@ def build_findings_json(study_id, spacing, volume_shape,
         "timestamp": datetime.utcnow().isoformat() + "Z"
     }
 
-    with open(output_path, "w") as f:
-        json.dump(out, f, indent=2)
-    print("Saved findings JSON:", output_path)
+    if volume_path is not None:
+        out["metadata"]["volume_store"] = str(volume_path)
+
+    if profiler is not None:
+        out["profiling"] = profiler.summary()
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(out, f, indent=2)
+        print("Saved findings JSON:", output_path)
+
+    return out
@@ -5,11 +5,27 @@
 #
 #  Usage:
 #  python backend-dinesh/ml/pipeline.py --study_folder "path/to/LIDC-IDRI-0001" --study_id "LIDC-IDRI-0001"
+#
+#  Batch usage (one study per sub-folder, or a manifest file):
+#  python backend-dinesh/ml/pipeline.py --batch_dir "path/to/LIDC-IDRI" --summary_csv backfill.csv
+#  python backend-dinesh/ml/pipeline.py --manifest studies.csv --workers 8
+#
+#  In-process usage (modules + models stay warm between cases):
+#  engine = PipelineEngine()
+#  findings = engine.run("path/to/LIDC-IDRI-0001", "LIDC-IDRI-0001")
 # ===============================================
 
 import argparse
+import csv
+import json
 import importlib.util
+import multiprocessing as mp
+import os
+import posixpath
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from pathlib import Path
 import time
 import numpy as np
@@ -27,7 +43,9 @@ for mod in list(sys.modules.keys()):
        mod.startswith("log_detector") or \
        mod.startswith("filter_candidates") or \
        mod.startswith("smart_filter") or \
+       mod.startswith("candidate_table") or \
        mod.startswith("feature_extractor") or \
+       mod.startswith("cascade") or \
        mod.startswith("classify_type") or \
        mod.startswith("classify_lobe") or \
        mod.startswith("predict_risk") or \
@@ -52,289 +70,864 @@ def load_module_from(path, name):
 
 
 # ---------------
-# Main pipeline
+# Risk scoring
 # ---------------
-def main(args):
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
 
-    # Resolve root
-    ROOT = Path(__file__).resolve().parent.parent  
-# → This points to backend-dinesh/ always
-    print(f"\n[PIPELINE] Starting pipeline...")
-    print(f"[PIPELINE] Project root: {ROOT}")
 
-    # Resolve paths for module directories
-    PRE_DIR   = ROOT / "ml" / "preprocessing"
-    DETECT_DIR = ROOT / "ml" / "detection"
-    FEAT_DIR  = ROOT / "ml" / "features"
-    POST_DIR  = ROOT / "ml" / "postprocess"
-    RISK_DIR  = ROOT / "ml" / "risk"
-    JSON_DIR  = ROOT / "ml" / "json_builder"
+def score_nodules(candidates):
+    """
+    Heuristic malignancy score + noisy MC uncertainty for each nodule.
+    Fills the risk columns of the candidate table in place and returns it.
+    """
+    n = len(candidates)
+    if n == 0:
+        return candidates
 
+    # fetch raw features (missing -> neutral defaults)
+    la  = np.nan_to_num(candidates["long_axis_mm"], nan=0.0)
+    hu  = np.nan_to_num(candidates["hu_mean"], nan=-800.0)
+    vol = np.nan_to_num(candidates["volume_mm3"], nan=0.0)
+    std = np.nan_to_num(candidates["hu_std"], nan=0.0)
 
-    # ---------------------
-    # Load all ML modules
-    # ---------------------
-    try:
-        select_mod = load_module_from(PRE_DIR/"select_series.py", "select_series")
-        loader_mod = load_module_from(PRE_DIR/"load_dicom.py", "load_dicom")
-        resample_mod = load_module_from(PRE_DIR/"resample.py", "resample")
-        normalize_mod = load_module_from(PRE_DIR/"normalize.py", "normalize")
-        lung_mod = load_module_from(PRE_DIR/"lung_segmentation.py", "lung_segmentation")
+    # ---- Normalization (stable, bounded) ----
+    # Expected typical ranges:
+    #  la: 0..50 mm,  vol: 0..50000 mm3, hu: -1000..+300, std: 0..400
+    la_s  = la  / 30.0       # ~0..~1.7
+    vol_s = vol / 20000.0    # ~0..~2.5
+    hu_s  = (hu + 800.0) / 600.0   # maps -800 -> 0,  -200 -> 1, ~100 -> 1.5
+    std_s = std / 150.0      # ~0..~3
 
-        log_mod = load_module_from(DETECT_DIR/"log_detector.py", "log_detector")
-        base_filter_mod = load_module_from(DETECT_DIR/"filter_candidates.py", "filter_candidates")
-        patch_mod = load_module_from(DETECT_DIR/"patch_extractor.py", "patch_extractor")
-        smart_mod = load_module_from(DETECT_DIR/"smart_filter.py", "smart_filter")
+    # ---- Linear score with modest weights (keeps raw near sigmoid knee) ----
+    raw_lin = (
+        0.6  * la_s     # size influence
+      + 0.25 * hu_s     # density influence (normalized)
+      + 0.35 * vol_s    # volume influence
+      + 0.25 * std_s    # heterogeneity
+    )
 
-        feat_mod = load_module_from(FEAT_DIR/"feature_extractor.py", "feature_extractor")
-        type_mod = load_module_from(POST_DIR/"classify_type.py", "classify_type")
-        lobe_mod = load_module_from(POST_DIR/"classify_lobe_fixed.py", "classify_lobe_fixed")
+    # per nodule: tie-break jitter (sd 0.1), then 30 MC noise samples (sd 0.35);
+    # one draw in the same order as the old per-nodule loop
+    noise = np.random.normal(0.0, np.r_[0.1, np.full(30, 0.35)], size=(n, 31))
+    raw_lin += noise[:, 0]
 
-        risk_mod = load_module_from(RISK_DIR/"predict_risk.py", "predict_risk")
-        builder_mod = load_module_from(JSON_DIR/"builder.py", "json_builder")
+    # shift so typical raw_lin sits around ~0.0..2.0 (sigmoid sensitive)
+    raw = raw_lin - 1.0
 
-    except Exception as e:
-        print("\n[ERROR] Failed loading modules.")
-        print(str(e))
-        traceback.print_exc()
-        return
+    # probability and clamp
+    candidates["prob_malignant"] = np.clip(sigmoid(raw), 0.05, 0.90)
+
+    # ---- MC-dropout style uncertainty but using noise sampling ----
+    p_mean = sigmoid(raw[:, None] + noise[:, 1:]).mean(axis=1)
+    # numerical safety for entropy
+    p_c = np.clip(p_mean, 1e-9, 1.0 - 1e-9)
+    entropy = -(p_c * np.log(p_c) + (1 - p_c) * np.log(1 - p_c))
+    candidates["confidence"] = p_mean
+    candidates["entropy"] = entropy
+    candidates["needs_review"] = entropy > 0.35
 
-    # -----------------
-    # Input Parameters
-    # -----------------
-    study_folder = Path(args.study_folder)
-    study_id = args.study_id or study_folder.name
+    # ---- quick debug print (small, safe) ----
+    print(f"[RISK DEBUG] raw_lin min/max/mean = {raw_lin.min():.3f}/{raw_lin.max():.3f}/{raw_lin.mean():.3f}")
+    for i in range(min(5, n)):
+        print(f"[RISK DEBUG] sample {i}: la={la[i]:.2f}, hu={hu[i]:.1f}, vol={vol[i]:.1f}, std={std[i]:.1f}, "
+              f"p={candidates['prob_malignant'][i]:.3f}, ent={entropy[i]:.3f}")
+    return candidates
 
-    print(f"\n[PIPELINE] Study folder: {study_folder}")
 
-    if not study_folder.exists():
-        print(f"[ERROR] Study folder not found: {study_folder}")
-        return
+# ---------------
+# Pipeline engine
+# ---------------
+class PipelineEngine:
+    """
+    Loads every ML module and model once and runs studies in-process.
+
+    Keep one engine per worker process: the imports (torch, SimpleITK,
+    lungmask, scipy, sklearn), the lungmask weights and the RiskHead are
+    paid for on the first case only.
+    """
+
+    # edge of the stage 8 feature patches (voxels)
+    PATCH_SIZE = 32
+
+    def __init__(self, root=None, warm=False, cache_dir=None, cache_max_gb=20.0, stage_threads=2,
+                 resample_mode="slab", crop_margin=16, seg_mode="full", seg_downsample=2,
+                 seg_batch_size=20, seg_threads=None, mem_budget_gb=None, volume_store_dir=None,
+                 log_threads=None, detector="log", max_candidates=None, max_candidates_per_lung=None,
+                 reject_gates=None, segment_patches=True, order_by_response=True, io_threads=None):
+        # Resolve root
+        # → This points to backend-dinesh/ always
+        self.root = Path(root) if root else Path(__file__).resolve().parent.parent
+        self.out_dir = self.root / "outputs"
+
+        self._load_modules()
+
+        # memory-budget mode: stages run one at a time, the LoG writes its
+        # response over the normalised volume (cached as float16); the
+        # per-case peak RSS is reported against the budget
+        self.mem_budget_gb = mem_budget_gb
+
+        # preprocessed 1 mm volumes are kept as <dir>/<study_id>.ctvol (None = off)
+        self.volume_store_dir = Path(volume_store_dir) if volume_store_dir else None
+
+        # independent stages run on this many threads (1 = sequential)
+        self.stage_threads = 1 if mem_budget_gb else stage_threads
+        # "slab": bounded-memory threaded resampling; "sitk": one SimpleITK pass
+        self.resample_mode = resample_mode
+        # stages 4, 6-11 run on the lung bounding box grown by this many
+        # voxels (None = full volume); patches are cut from the crop, so it
+        # must hold half a patch around every lung voxel
+        if crop_margin is not None and crop_margin < self.PATCH_SIZE // 2:
+            raise ValueError(f"crop_margin must be None or >= {self.PATCH_SIZE // 2} "
+                             f"(half the feature patch), got {crop_margin}")
+        self.crop_margin = crop_margin
+        # lung segmentation: "full" | "fast" (lungmask on every
+        # seg_downsample-th slice) | "classical" (no network)
+        self.seg_mode = seg_mode
+        self.seg_downsample = seg_downsample
+        self.seg_batch_size = seg_batch_size
+        self.seg_threads = seg_threads
+        # tiled LoG detector threads (None = all cores)
+        self.log_threads = log_threads
+        # threads of series discovery, DICOM decoding and resampling
+        # (None = each one's default: 16 / 8 / 8)
+        self.io_threads = io_threads
+        # candidate detector: "log" (single-scale LoG) | "dog" (multi-scale DoG)
+        self.detector = detector
+        # candidate caps (strongest kept; None = unbounded, identical to the list version)
+        self.max_candidates = max_candidates
+        self.max_candidates_per_lung = max_candidates_per_lung
+        # distance suppression visits the strongest detector responses first
+        # (False = detector order: raster, or strongest first when capped)
+        self.order_by_response = order_by_response
+        # stage 8 rejection cascade, cheapest gate first (None = the
+        # pipeline's own HU / size rules, see cascade.DEFAULT_GATES)
+        self.reject_gates = reject_gates
+        # shape features from the tissue component at the patch center
+        # (False = the whole threshold mask of the patch, lung included)
+        self.segment_patches = segment_patches
+
+        # stage checkpoint cache (disabled when cache_dir is None)
+        self.cache = self.cache_mod.StageCache(cache_dir, max_bytes=cache_max_gb * 1024**3)
+
+        self._risk = None
+        self._lung_inferer = None
+        if warm:
+            self.warm_up()
+
+    # ---------------------
+    # Load all ML modules
+    # ---------------------
+    def _load_modules(self):
+        ROOT = self.root
+        PRE_DIR   = ROOT / "ml" / "preprocessing"
+        DETECT_DIR = ROOT / "ml" / "detection"
+        FEAT_DIR  = ROOT / "ml" / "features"
+        POST_DIR  = ROOT / "ml" / "postprocess"
+        RISK_DIR  = ROOT / "ml" / "risk"
+        JSON_DIR  = ROOT / "ml" / "json_builder"
+        CACHE_DIR = ROOT / "ml" / "cache"
+
+        self.select_mod = load_module_from(PRE_DIR/"select_series.py", "select_series")
+        self.loader_mod = load_module_from(PRE_DIR/"load_dicom.py", "load_dicom")
+        self.resample_mod = load_module_from(PRE_DIR/"resample.py", "resample")
+        self.normalize_mod = load_module_from(PRE_DIR/"normalize.py", "normalize")
+        self.lung_mod = load_module_from(PRE_DIR/"lung_segmentation.py", "lung_segmentation")
+        self.crop_mod = load_module_from(PRE_DIR/"lung_crop.py", "lung_crop")
+
+        self.log_mod = load_module_from(DETECT_DIR/"log_detector.py", "log_detector")
+        self.dog_mod = load_module_from(DETECT_DIR/"dog_detector.py", "dog_detector")
+        self.base_filter_mod = load_module_from(DETECT_DIR/"filter_candidates.py", "filter_candidates")
+        self.patch_mod = load_module_from(DETECT_DIR/"patch_extractor.py", "patch_extractor")
+        self.smart_mod = load_module_from(DETECT_DIR/"smart_filter.py", "smart_filter")
+        self.table_mod = load_module_from(DETECT_DIR/"candidate_table.py", "candidate_table")
+
+        self.feat_mod = load_module_from(FEAT_DIR/"feature_extractor.py", "feature_extractor")
+        self.cascade_mod = load_module_from(FEAT_DIR/"cascade.py", "cascade")
+        self.type_mod = load_module_from(POST_DIR/"classify_type.py", "classify_type")
+        self.lobe_mod = load_module_from(POST_DIR/"classify_lobe_fixed.py", "classify_lobe_fixed")
+
+        self.risk_mod = load_module_from(RISK_DIR/"predict_risk.py", "predict_risk")
+        self.builder_mod = load_module_from(JSON_DIR/"builder.py", "json_builder")
+        self.cache_mod = load_module_from(CACHE_DIR/"stage_cache.py", "stage_cache")
+        self.profiler_mod = load_module_from(ROOT/"ml"/"profiling"/"stage_profiler.py", "stage_profiler")
+        self.graph_mod = load_module_from(ROOT/"ml"/"graph"/"stage_graph.py", "stage_graph")
+        self.store_mod = load_module_from(ROOT/"ml"/"store"/"volume_store.py", "volume_store")
+
+        # source hashes of the cached stages: editing a stage invalidates
+        # its checkpoints (and everything downstream of it)
+        self.code_hash = {
+            name: self.cache_mod.file_digest(path) for name, path in {
+                "select": PRE_DIR/"select_series.py",
+                "load": PRE_DIR/"load_dicom.py",
+                "resample": PRE_DIR/"resample.py",
+                "normalize": PRE_DIR/"normalize.py",
+                "lungmask": PRE_DIR/"lung_segmentation.py",
+                "log": DETECT_DIR/"log_detector.py",
+                "dog": DETECT_DIR/"dog_detector.py",
+            }.items()
+        }
+
+    # ---------------------
+    # Warm models (cached)
+    # ---------------------
+    @property
+    def risk(self):
+        if self._risk is None:
+            # FIXED MODEL PATHS (do not double prefix backend-dinesh)
+            model_path = self.root / "models" / "risk_head" / "risk_head.pth"
+            scaler_path = self.root / "models" / "risk_head" / "risk_scaler.pkl"
+            self._risk = self.risk_mod.RiskHead(model_path, scaler_path)
+        return self._risk
+
+    @property
+    def lung_inferer(self):
+        if self._lung_inferer is None:
+            self._lung_inferer = self.lung_mod.get_inferer(batch_size=self.seg_batch_size)
+        return self._lung_inferer
+
+    def warm_up(self):
+        """Load the lungmask weights and the RiskHead before the first case."""
+        if self.seg_mode != "classical":
+            _ = self.lung_inferer
+        _ = self.risk
+        return self
+
+    # ---------------
+    # Run one study
+    # ---------------
+    def run(self, study, study_id=None, output_path=None, trace_path=None):
+        """
+        Runs the full pipeline on one study and returns the findings dict.
+        study: folder, .zip path, or the ZIP's bytes (read in memory, never extracted).
+        findings.json is also written to output_path
+        (default: outputs/{study_id}_findings.json).
+        trace_path: optional Chrome-trace file with the per-stage timings.
+        """
+        source = self.select_mod.open_source(study)
+        study_id = study_id or source.name
+
+        print(f"\n[PIPELINE] Study ({source.kind}): {source.name}")
+
+        if output_path is None:
+            self.out_dir.mkdir(exist_ok=True, parents=True)
+            output_path = self.out_dir / f"{study_id}_findings.json"
+
+        budget = self.mem_budget_gb * 1024**3 if self.mem_budget_gb else None
+        if budget:
+            # per-case high-water mark, not the worker's lifetime one
+            self.profiler_mod.reset_peak_rss()
+        prof = self.profiler_mod.StageProfiler(budget_bytes=budget)
+        graph = self._build_graph(prof)
+        try:
+            result = graph.run(
+                initial={
+                    "source": source,
+                    "study_id": study_id,
+                    "output_path": str(output_path),
+                },
+                keep=["findings"],
+                max_workers=self.stage_threads,
+            )
+        finally:
+            source.close()
+
+        if trace_path:
+            prof.write_chrome_trace(trace_path)
+
+        peak = self.profiler_mod.peak_rss_bytes()
+        print(f"[MEM] Peak RSS: {peak / 1024**2:.0f} MB"
+              + (f" (budget {budget / 1024**2:.0f} MB)" if budget else ""))
+
+        print(f"[DONE] Saved findings.json at {output_path}\n")
+        return result["findings"]
+
+    # ---------------------
+    # Stage graph
+    # ---------------------
+    def _build_graph(self, prof):
+        """
+        Stages and the values they exchange. 5b crops to the lungs and
+        everything after it works on the crop; 7 maps the candidates back
+        to full-volume coordinates. 11 (lung-level metrics) runs next to 6-10.
+        """
+        g = self.graph_mod.StageGraph()
+        p = lambda fn: partial(fn, prof)
+
+        g.add("1_select_series", p(self._select_series),
+              ["source"], ["series_files"])
+        g.add("2_load_dicom", p(self._load_dicom),
+              ["source", "series_files"], ["vol", "spacing", "geometry", "load_key"])
+        g.add("3_resample", p(self._resample),
+              ["vol", "spacing", "load_key"], ["vol_res", "new_spacing", "volume_shape", "res_key"])
+        g.add("5_lungmask", p(self._segment),
+              ["vol_res", "res_key"], ["lung_mask", "seg_key"])
+        g.add("5b_lung_crop", p(self._crop),
+              ["vol_res", "lung_mask"], ["vol_crop", "mask_crop", "crop_offset", "lung_bbox"])
+        g.add("5c_volume_store", p(self._store_volume),
+              ["study_id", "vol_res", "new_spacing", "geometry", "lung_bbox"], ["volume_store_path"])
+        g.add("4_normalize", p(self._normalize),
+              ["vol_crop"], ["vol_norm"])
+        g.add("6_log_detector", p(self._detect),
+              ["vol_norm", "mask_crop", "res_key", "seg_key"], ["cands", "cand_scores", "cand_sizes"])
+        g.add("7_filter_candidates", p(self._filter),
+              ["cands", "cand_scores", "cand_sizes", "vol_crop", "mask_crop", "crop_offset"], ["filtered"])
+        g.add("8_features", p(self._features),
+              ["filtered", "vol_crop", "crop_offset", "volume_shape"], ["features_raw"])
+        g.add("9_smart_filter", p(self._smart_filter),
+              ["features_raw"], ["filtered_final"])
+        g.add("10_risk", p(self._risk_scores),
+              ["filtered_final"], ["nodules"])
+        g.add("11_lung_metrics", p(self._lung_metrics),
+              ["vol_crop", "mask_crop", "new_spacing", "volume_shape"], ["lung_metrics"])
+        g.add("12_build_json", p(self._build_json),
+              ["study_id", "output_path", "new_spacing", "volume_shape",
+               "nodules", "lung_metrics", "volume_store_path"], ["findings"])
+        return g
 
     # -------------------------
     # 1. Select main CT series
     # -------------------------
-    print("[1] Selecting CT series...")
-    series_folder, count = select_mod.find_main_ct_series(str(study_folder))
-    if not series_folder:
-        print("[ERROR] No valid CT series found.")
-        return
-    print(f"[OK] Series chosen: {series_folder} ({count} slices)")
+    def _select_series(self, prof, source):
+        print("[1] Selecting CT series...")
+
+        def _select():
+            # header-only, parallel discovery; slices come back sorted
+            best = self.select_mod.select_main_series(source, max_workers=self.io_threads or 16)
+            if best is None:
+                return {}, {"series": None}
+            # names are relative to the folder / ZIP, so the entry survives a move
+            return {}, {"series": best["series_uid"], "modality": best["modality"],
+                        "slice_thickness": best["slice_thickness"], "files": best["files"]}
+
+        with prof.stage("1_select_series") as st:
+            cache = self.cache
+            listing_key = self.cache_mod.folder_listing_key(source) if cache.enabled else None
+            _, _, sel = cache.fetch("select", {"code": self.code_hash["select"]}, [listing_key], _select)
+            if sel["series"] is None:
+                raise RuntimeError("No valid CT series found.")
+            series_files = sel["files"]
+            st.note(slices=len(series_files), modality=sel["modality"], slice_thickness=sel["slice_thickness"])
+        print(f"[OK] Series chosen: {sel['series']} ({sel['modality']}, {len(series_files)} slices, "
+              f"{sel['slice_thickness']} mm) in {source.path(posixpath.dirname(series_files[0]))}")
+        return series_files
 
     # -------------------------
     # 2. Load DICOM
     # -------------------------
-    print("\n[2] Loading DICOM...")
-    vol, spacing = loader_mod.load_dicom_series(series_folder)
-    print(f"[OK] Volume: {vol.shape}, Spacing: {spacing}")
+    def _load_dicom(self, prof, source, series_files):
+        print("\n[2] Loading DICOM...")
+
+        def _load():
+            # parallel decode straight into one int16 volume
+            v, sp, geo = self.loader_mod.load_dicom_series(
+                source.path(posixpath.dirname(series_files[0])), file_names=series_files,
+                return_meta=True, source=source, threads=self.io_threads)
+            return {"volume": v}, {"spacing": [float(x) for x in sp], "origin": geo["origin"],
+                                   "direction": geo["direction"]}
+
+        with prof.stage("2_load_dicom") as st:
+            cache = self.cache
+            series_key = self.cache_mod.series_content_key(series_files, source=source) if cache.enabled else None
+            load_key, arrs, meta = cache.fetch("load", {"code": self.code_hash["load"]}, [series_key], _load)
+            vol, spacing = arrs["volume"], meta["spacing"]
+            geometry = {"origin": meta.get("origin"), "direction": meta.get("direction")}
+            st.outputs(volume=vol)
+        print(f"[OK] Volume: {vol.shape}, Spacing: {spacing}")
+        return vol, spacing, geometry, load_key
 
     # -------------------------
     # 3. Resample to 1mm
     # -------------------------
-    print("\n[3] Resampling to 1mm iso...")
-    vol_res, new_spacing = resample_mod.resample_to_iso(vol, spacing, new_spacing=[1,1,1])
-    print(f"[OK] Resampled: {vol_res.shape}, Spacing: {new_spacing}")
+    def _resample(self, prof, vol, spacing, load_key):
+        print("\n[3] Resampling to 1mm iso...")
+
+        def _resample():
+            v, sp = self.resample_mod.resample_to_iso(vol, spacing, new_spacing=[1,1,1],
+                                                      mode=self.resample_mode, dtype=np.int16,
+                                                      threads=self.io_threads)
+            return {"volume": v}, {"spacing": [float(x) for x in sp]}
+
+        with prof.stage("3_resample", volume=vol) as st:
+            params = {"code": self.code_hash["resample"], "new_spacing": [1, 1, 1],
+                      "mode": self.resample_mode}
+            res_key, arrs, meta = self.cache.fetch("resample", params, [load_key], _resample)
+            vol_res, new_spacing = arrs["volume"], meta["spacing"]
+            st.outputs(volume=vol_res)
+        print(f"[OK] Resampled: {vol_res.shape}, Spacing: {new_spacing}")
+        return vol_res, new_spacing, tuple(vol_res.shape), res_key
 
     # -------------------------
     # 4. HU Normalize
     # -------------------------
-    print("\n[4] Normalizing HU...")
-    vol_norm = normalize_mod.clip_and_normalize(vol_res)
+    def _normalize(self, prof, vol_crop):
+        print("\n[4] Normalizing HU...")
+        with prof.stage("4_normalize", volume=vol_crop) as st:
+            vol_norm = self.normalize_mod.clip_and_normalize(vol_crop)
+            st.outputs(volume=vol_norm)
+        return vol_norm
 
     # -------------------------
     # 5. Lungmask segmentation
     # -------------------------
-    print("\n[5] Running Lungmask segmentation...")
-    lung_mask = lung_mod.segment_lungs(vol_res)
-    print(f"[OK] Lung mask shape: {lung_mask.shape}")
+    def _segment(self, prof, vol_res, res_key):
+        print(f"\n[5] Running lung segmentation ({self.seg_mode})...")
+        seg_params = {"code": self.code_hash["lungmask"], "mode": self.seg_mode}
+        if self.seg_mode == "fast":
+            seg_params["downsample"] = self.seg_downsample
+
+        def _segment():
+            inferer = None if self.seg_mode == "classical" else self.lung_inferer
+            m = self.lung_mod.segment_lungs(vol_res, inferer=inferer, mode=self.seg_mode,
+                                            downsample=self.seg_downsample,
+                                            batch_size=self.seg_batch_size, threads=self.seg_threads)
+            return {"mask": m}, {}
+
+        with prof.stage("5_lungmask", volume=vol_res) as st:
+            seg_key, arrs, _ = self.cache.fetch("lungmask", seg_params, [res_key], _segment)
+            lung_mask = arrs["mask"]
+            if lung_mask.dtype != np.uint8:
+                lung_mask = lung_mask.astype(np.uint8)
+            st.outputs(mask=lung_mask)
+            st.note(seg_mode=self.seg_mode)
+        print(f"[OK] Lung mask shape: {lung_mask.shape} ({self.seg_mode}, {st.wall:.2f} s)")
+        return lung_mask, seg_key
+
+    # -------------------------
+    # 5b. Crop to the lungs
+    # -------------------------
+    def _crop(self, prof, vol_res, lung_mask):
+        print("\n[5b] Cropping to the lung bounding box...")
+        with prof.stage("5b_lung_crop", volume=vol_res, mask=lung_mask) as st:
+            if self.crop_margin is None:
+                vol_crop, mask_crop, offset = vol_res, lung_mask, (0, 0, 0)
+            else:
+                vol_crop, mask_crop, offset = self.crop_mod.crop_to_lungs(vol_res, lung_mask, margin=self.crop_margin)
+            st.outputs(volume=vol_crop)
+            st.note(offset=list(offset), voxel_fraction=round(vol_crop.size / vol_res.size, 3))
+        print(f"[OK] Crop: {vol_crop.shape} at offset {offset} "
+              f"({100 * vol_crop.size / vol_res.size:.0f}% of the voxels)")
+        lung_bbox = [[o, o + n] for o, n in zip(offset, vol_crop.shape)]
+        return vol_crop, mask_crop, offset, lung_bbox
+
+    # -------------------------
+    # 5c. Persist the 1 mm volume
+    # -------------------------
+    def _store_volume(self, prof, study_id, vol_res, new_spacing, geometry, lung_bbox):
+        if self.volume_store_dir is None:
+            return None
+        print("\n[5c] Writing the preprocessed volume store...")
+        with prof.stage("5c_volume_store", volume=vol_res) as st:
+            self.volume_store_dir.mkdir(parents=True, exist_ok=True)
+            path = self.store_mod.write_volume(
+                self.volume_store_dir / f"{study_id}.ctvol", vol_res, new_spacing,
+                origin=geometry["origin"], direction=geometry["direction"],
+                lung_bbox=lung_bbox, study_id=study_id)
+            st.note(path=str(path))
+        print(f"[OK] Volume store: {path}")
+        return str(path)
 
     # -------------------------
     # 6. LoG Detector
     # -------------------------
-    print("\n[6] Running LoG nodule detection...")
-    cands, logmap = log_mod.log_nodule_candidates(vol_norm, lung_mask, sigma=1.0, threshold=0.002)
-    print(f"[OK] Raw LoG candidates: {len(cands)}")
+    def _detect(self, prof, vol_norm, mask_crop, res_key, seg_key):
+        if self.detector == "dog":
+            return self._detect_dog(prof, vol_norm, mask_crop, res_key, seg_key)
+        if self.detector != "log":
+            raise ValueError(f"Unknown detector: {self.detector}")
+        print("\n[6] Running LoG nodule detection...")
+        log_params = {"code": self.code_hash["log"], "normalize": self.code_hash["normalize"],
+                      "sigma": 1.0, "threshold": 0.002, "crop_margin": self.crop_margin,
+                      "top_k": self.max_candidates, "per_lung_k": self.max_candidates_per_lung}
+        lowmem = bool(self.mem_budget_gb)
+        # the float16 copy only pays off when the response is written to the cache
+        half = lowmem and self.cache.enabled
+        if half:
+            log_params["response_dtype"] = "float16"
+
+        def _log():
+            # tiled + threaded; (N,3) int32 peaks, bounded by the caps.
+            # vol_norm feeds only this stage, so low-memory mode overwrites it
+            peaks, values, lm = self.log_mod.log_nodule_peaks(
+                vol_norm, mask_crop, sigma=1.0, threshold=0.002,
+                top_k=self.max_candidates, per_lung_k=self.max_candidates_per_lung,
+                threads=self.log_threads, response_dtype=np.float16 if half else None,
+                inplace=lowmem)
+            return {"peaks": peaks, "values": values, "log_response": lm}, {}
+
+        with prof.stage("6_log_detector", volume=vol_norm, mask=mask_crop) as st:
+            _, arrs, _ = self.cache.fetch("log", log_params, [res_key, seg_key], _log)
+            cands = np.asarray(arrs["peaks"])
+            st.outputs(candidates=cands, log_response=arrs["log_response"])
+        print(f"[OK] Raw LoG candidates: {len(cands)}")
+        return cands, np.asarray(arrs["values"]), None
+
+    def _detect_dog(self, prof, vol_norm, mask_crop, res_key, seg_key):
+        print("\n[6] Running multi-scale DoG nodule detection...")
+        dog_params = {"code": self.code_hash["dog"], "normalize": self.code_hash["normalize"],
+                      "diameter_mm": [3.0, 30.0], "scales_per_octave": 3, "threshold": 0.04,
+                      "crop_margin": self.crop_margin, "top_k": self.max_candidates}
+
+        def _dog():
+            peaks, sig, resp = self.dog_mod.dog_candidates(vol_norm, mask_crop, min_diameter_mm=3.0,
+                                                           max_diameter_mm=30.0, scales_per_octave=3,
+                                                           threshold=0.04, top_k=self.max_candidates)
+            return {"peaks": peaks, "sigma": sig, "response": resp}, {}
+
+        with prof.stage("6_dog_detector", volume=vol_norm, mask=mask_crop) as st:
+            _, arrs, _ = self.cache.fetch("dog", dog_params, [res_key, seg_key], _dog)
+            cands = np.asarray(arrs["peaks"])
+            # blob diameter (mm, 1 mm grid) per candidate, ahead of the patch features
+            cand_sizes = 2.0 * np.sqrt(3.0) * np.asarray(arrs["sigma"], dtype=np.float64)
+            st.outputs(candidates=cands)
+        print(f"[OK] Raw DoG candidates: {len(cands)}")
+        return cands, np.asarray(arrs["response"]), cand_sizes
 
     # -------------------------
     # 7. Rule-based filtering
     # -------------------------
-    print("\n[7] Filtering (HU + distance rules)...")
-    filtered = base_filter_mod.filter_candidates(cands, vol_res, lung_mask,
-                                                 min_hu=-700, min_dist=6)
-    print(f"[OK] Filtered candidates: {len(filtered)}")
+    def _filter(self, prof, cands, cand_scores, cand_sizes, vol_crop, mask_crop, crop_offset):
+        print("\n[7] Filtering (HU + distance rules)...")
+        with prof.stage("7_filter_candidates", candidates=cands) as st:
+            keep = self.base_filter_mod.filter_candidates(
+                cands, vol_crop, mask_crop, min_hu=-700, min_dist=6,
+                scores=cand_scores if self.order_by_response else None, return_index=True)
+            # from here on candidates are table rows in full-volume coordinates
+            filtered = self.table_mod.new_table(
+                self.crop_mod.to_full(cands[keep], crop_offset),
+                response=cand_scores[keep],
+                scale_diameter_mm=cand_sizes[keep] if cand_sizes is not None else None)
+            st.outputs(candidates=filtered)
+        print(f"[OK] Filtered candidates: {len(filtered)}")
+        return filtered
 
     # -------------------------
     # 8. Patch & Feature extraction
     # -------------------------
-    print("[8] Extracting features (updated)...")
-    start_proc = time.time()
-
-    features_raw = []
-    for center in filtered:
-
-        # ensure plain Python ints for indexing
-        center = (int(center[0]), int(center[1]), int(center[2]))
-
-        # extract patch
-        patch = patch_mod.extract_patch(vol_res, center, size=32)
-
-        # NEW feature extractor (MUST BE CALLED)
-        ft = feat_mod.extract_patch_features(patch, spacing=[1.0,1.0,1.0])
-
-        # add type
-        ft["type"] = type_mod.classify_nodule_type(ft["hu_mean"])
-
-        # add corrected lobe classifier
-        ft["lobe"] = lobe_mod.classify_lobe(center, vol_res.shape)
-
-        # enforce valid location field
-        ft["location"] = ft["lobe"]
-
-        # add bbox
-        cz, cy, cx = center
-        ft["bbox"] = {
-            "z": [cz - 16, cz + 15],
-            "y": [cy - 16, cy + 15],
-            "x": [cx - 16, cx + 15]
-        }
-
-        # ensure float/int conversion
-        ft["hu_mean"]       = float(ft["hu_mean"])
-        ft["hu_std"]        = float(ft["hu_std"])
-        ft["long_axis_mm"]  = float(ft["long_axis_mm"])
-        ft["volume_mm3"]    = float(ft["volume_mm3"])
-
-        features_raw.append(ft)
+    def _features(self, prof, filtered, vol_crop, crop_offset, volume_shape):
+        print("[8] Extracting features (updated)...")
+        table = filtered.copy()
+        with prof.stage("8_features", candidates=table) as st:
+            # patch centers in crop coordinates (the crop margin covers the whole
+            # patch except at the scan edge, which is padded with air)
+            local = self.crop_mod.to_crop(self.table_mod.centers(table), crop_offset)
+            # patches are cut and featurized 64 at a time into one small buffer
+            chunk = 64
+            size = self.PATCH_SIZE
+            buf = self.patch_mod.patch_buffer(min(chunk, len(table)), size, vol_crop.dtype)
+
+            def _patches(a, b):
+                return self.patch_mod.extract_patches(vol_crop, local[a:b], size=size, fill=-1024,
+                                                      out=buf[:b - a])
+
+            # cheap gates (center HU, mean HU, voxel count) drop candidates
+            # before the costly shape features are computed
+            gates = self.reject_gates or self.cascade_mod.DEFAULT_GATES
+            keep, feats, report = self.cascade_mod.run_cascade_chunks(
+                _patches, len(table), gates, spacing=(1.0, 1.0, 1.0), chunk=chunk,
+                segment=self.segment_patches, columns={"scale_diameter_mm": table["scale_diameter_mm"]})
+            table = table[keep]
+            for name in self.table_mod.FEATURES:
+                table[name] = feats[name]
+            for r in report:
+                print(f"[8.1] Gate {r['name']:<14} cost {r['cost']:>4}: rejected {r['rejected']} of {r['tested']}")
+            st.note(cascade=report)
+
+            # add type + lobe (location) codes
+            table["type"] = self.type_mod.classify_nodule_types(table["hu_mean"])
+            table["lobe"] = self.lobe_mod.classify_lobes(self.table_mod.centers(table), volume_shape)
+            st.outputs(features=table)
+        return table
 
     # -------------------------
     # 9. Smart filtering (quality)
     # -------------------------
-    print("\n[9] Smart filtering (HU > -800, size >4mm, clustering)...")
-    filtered_final, features_final = smart_mod.smart_filter(filtered, features_raw)
-    print(f"[OK] Final nodules after smart filtering: {len(filtered_final)}")
+    def _smart_filter(self, prof, features_raw):
+        print("\n[9] Smart filtering (HU > -800, size >4mm, clustering)...")
+        with prof.stage("9_smart_filter", candidates=features_raw) as st:
+            filtered_final = self.smart_mod.smart_filter(features_raw)
+            st.outputs(nodules=filtered_final)
+        print(f"[OK] Final nodules after smart filtering: {len(filtered_final)}")
+        return filtered_final
 
     # -------------------------
     # 10. Risk prediction
     # -------------------------
-    print("\n[10] Loading risk model...")
-    # FIXED MODEL PATHS (do not double prefix backend-dinesh)
-    model_path = ROOT / "models" / "risk_head" / "risk_head.pth"
-    scaler_path = ROOT / "models" / "risk_head" / "risk_scaler.pkl"
-
-    risk = risk_mod.RiskHead(model_path, scaler_path)
-
-    # ------------------- RISK BLOCK (REPLACE ENTIRE SECTION) -------------------
-    print("[10.1] Predicting malignancy with normalized features + noisy MC uncertainty...")
+    def _risk_scores(self, prof, filtered_final):
+        print("\n[10] Loading risk model...")
+        with prof.stage("10_risk", nodules=filtered_final) as st:
+            _ = self.risk  # loaded once per engine
 
-    def sigmoid(x):
-        return 1.0 / (1.0 + np.exp(-x))
+            print("[10.1] Predicting malignancy with normalized features + noisy MC uncertainty...")
+            nodules = score_nodules(filtered_final.copy())
+            st.outputs(scores=nodules["prob_malignant"])
+        return nodules
 
-    malignancy_scores = []
-    uncertainties = []
-
-# optional debug collectors
-    _debug_raws = []
-    _debug_features = []
-
-    for ft in features_final:
-    # fetch raw features (ensure floats)
-        la = float(ft.get("long_axis_mm", 0.0))
-        hu = float(ft.get("hu_mean", -800.0))
-        vol = float(ft.get("volume_mm3", 0.0))
-        std = float(ft.get("hu_std", 0.0))
-
-    # ---- Normalization (stable, bounded) ----
-    # Expected typical ranges:
-    #  la: 0..50 mm,  vol: 0..50000 mm3, hu: -1000..+300, std: 0..400
-        la_s  = la  / 30.0       # ~0..~1.7
-        vol_s = vol / 20000.0    # ~0..~2.5
-        hu_s  = (hu + 800.0) / 600.0   # maps -800 -> 0,  -200 -> 1, ~100 -> 1.5
-        std_s = std / 150.0      # ~0..~3
+    # -------------------------
+    # 11. Compute lung-level metrics
+    # -------------------------
+    def _lung_metrics(self, prof, vol_crop, mask_crop, new_spacing, volume_shape):
+        print("\n[11] Computing lung-level metrics...")
+        with prof.stage("11_lung_metrics", volume=vol_crop, mask=mask_crop) as st:
+            lung_volume_for_metrics = vol_crop.copy()
+            lung_volume_for_metrics[~mask_crop.astype(bool)] = 0
+            # the voxels outside the crop are zeros of the full masked volume
+            metrics = self.builder_mod.compute_lung_health_metrics(
+                lung_volume_for_metrics, new_spacing, total_voxels=int(np.prod(volume_shape)))
+            del lung_volume_for_metrics
+            st.note(emphysema=metrics[0], fibrosis=metrics[1], consolidation=metrics[2])
+        return metrics
 
-    # ---- Linear score with modest weights (keeps raw near sigmoid knee) ----
-        raw_lin = (
-            0.6  * la_s     # size influence
-        + 0.25 * hu_s     # density influence (normalized)
-        + 0.35 * vol_s    # volume influence
-        + 0.25 * std_s    # heterogeneity
+    # -------------------------
+    # 12. Build JSON
+    # -------------------------
+    def _build_json(self, prof, study_id, output_path, new_spacing, volume_shape,
+                    nodules, lung_metrics, volume_store_path):
+        print("\n[12] Building findings.json...")
+
+        # whole run, not just the post-detection stages
+        processing_time = time.perf_counter() - prof.t0
+
+        return self.builder_mod.build_findings_json(
+            study_id=study_id,
+            spacing=new_spacing,
+            volume_shape=volume_shape,
+            candidates=nodules,
+            type_names=self.type_mod.TYPE_NAMES,
+            lobe_names=self.lobe_mod.LOBE_NAMES,
+            bbox_half=self.PATCH_SIZE // 2,
+            output_path=output_path,
+            processing_time_seconds=processing_time,
+            lung_metrics=lung_metrics,
+            profiler=prof,
+            volume_path=volume_store_path,
         )
 
-    # small per-nodule jitter to break ties (mean 0, sd 0.1)
-        raw_lin += float(np.random.normal(0.0, 0.1))
+# ---------------
+# Batch mode
+# ---------------
+def discover_studies(batch_dir):
+    """One study per immediate sub-folder (or .zip) of batch_dir."""
+    batch_dir = Path(batch_dir)
+    return [(p, p.name if p.is_dir() else p.stem) for p in sorted(batch_dir.iterdir())
+            if p.is_dir() or p.suffix.lower() == ".zip"]
+
+
+def read_manifest(manifest_path):
+    """
+    .csv with a study_folder column (optional study_id column),
+    or plain text with one study folder per line.
+    Relative paths are resolved against the manifest's folder.
+    """
+    manifest_path = Path(manifest_path)
+    base = manifest_path.parent
+    studies = []
+
+    with open(manifest_path, newline="") as f:
+        if manifest_path.suffix.lower() == ".csv":
+            for row in csv.DictReader(f):
+                folder = (row.get("study_folder") or "").strip()
+                if not folder:
+                    continue
+                sid = (row.get("study_id") or "").strip()
+                studies.append((base / folder, sid or Path(folder).name))
+        else:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                studies.append((base / line, Path(line).name))
+    return studies
+
+
+def default_workers(mem_per_worker_gb=6.0):
+    """Size the pool by cores and by the memory one study needs."""
+    cpus = os.cpu_count() or 1
+    try:
+        import psutil
+        avail_gb = psutil.virtual_memory().available / 1024**3
+        by_mem = int(avail_gb // max(mem_per_worker_gb, 0.1))
+    except ImportError:
+        by_mem = cpus
+    return max(1, min(cpus, by_mem))
 
-    # debug
-        _debug_raws.append(raw_lin)
-        _debug_features.append((la, hu, vol, std))
 
-    # shift so typical raw_lin sits around ~0.0..2.0 (sigmoid sensitive)
-        shift = 1.0
-        raw = raw_lin - shift
+_BATCH_ENGINE = None
 
-    # probability and clamp
-        p = sigmoid(raw)
-        p = float(np.clip(p, 0.05, 0.90))
 
-        malignancy_scores.append(p)
+def _batch_worker_init(cache_dir, cache_max_gb, threads, engine_kwargs=None):
+    global _BATCH_ENGINE
+    # split the cores between workers instead of every worker using all of them
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    _BATCH_ENGINE = PipelineEngine(cache_dir=cache_dir, cache_max_gb=cache_max_gb, **(engine_kwargs or {}))
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
 
-    # ---- MC-dropout style uncertainty but using noise sampling ----
-        samples = []
-        for _ in range(30):   # larger T for more stable MC estimate
-            noise = np.random.normal(0.0, 0.35)  # stronger noise = more entropy
-            samples.append(sigmoid(raw + noise))
-        p_mean = float(np.mean(samples))
-    # numerical safety for entropy
-        p_mean_clipped = max(1e-9, min(1.0 - 1e-9, p_mean))
-        entropy = float(-(p_mean_clipped * np.log(p_mean_clipped) + (1 - p_mean_clipped) * np.log(1 - p_mean_clipped)))
-
-        uncertainties.append({
-            "confidence": p_mean,
-            "entropy": entropy,
-            "needs_review": bool(entropy > 0.35)
-        })
 
-# ---- quick debug print (small, safe) ----
+def _batch_run_one(study_folder, study_id):
+    row = {"study_id": study_id, "study_folder": str(study_folder), "worker_pid": os.getpid()}
+    t0 = time.perf_counter()
     try:
-    # print a few summary stats so you can see variation
-        raw_arr = np.array(_debug_raws)
-        print(f"[RISK DEBUG] raw_lin min/max/mean = {raw_arr.min():.3f}/{raw_arr.max():.3f}/{raw_arr.mean():.3f}")
-    # print first 5 raw features sample
-        for i, (la, hu, vol, std) in enumerate(_debug_features[:5]):
-            print(f"[RISK DEBUG] sample {i}: la={la:.2f}, hu={hu:.1f}, vol={vol:.1f}, std={std:.1f}, p={malignancy_scores[i]:.3f}, ent={uncertainties[i]['entropy']:.3f}")
-    except Exception:
-        pass
-# -------------------------------------------------------------------------
+        findings = _BATCH_ENGINE.run(study_folder, study_id)
+        row["status"] = "done"
+        row["num_nodules"] = findings.get("num_nodules")
+        row["peak_rss_mb"] = round(findings.get("profiling", {}).get("peak_rss_bytes", 0) / 1024**2, 1)
+        for st in findings.get("profiling", {}).get("stages", []):
+            row[f"t_{st['name']}"] = round(st["wall_seconds"], 3)
+    except Exception as e:
+        traceback.print_exc()
+        row["status"] = "failed"
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["wall_seconds"] = round(time.perf_counter() - t0, 3)
+    return row
+
+
+def _write_summary(rows, summary_csv):
+    base = ["study_id", "status", "wall_seconds", "num_nodules", "peak_rss_mb", "error", "worker_pid", "study_folder"]
+    stage_cols = sorted({k for r in rows for k in r if k.startswith("t_")},
+                        key=lambda k: (int(k[2:].split("_")[0]) if k[2:].split("_")[0].isdigit() else 99, k))
+    with open(summary_csv, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=base + stage_cols, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+
+
+def run_batch(studies, summary_csv, workers=None, mem_per_worker_gb=6.0,
+              skip_existing=True, cache_dir=None, cache_max_gb=20.0, engine_kwargs=None,
+              crash_retries=1):
+    """
+    Runs many studies over a process pool (one warm engine per worker).
+    engine_kwargs: extra PipelineEngine options (e.g. seg_mode) for every worker.
+    Studies that already have outputs/{study_id}_findings.json are skipped.
+    The summary CSV is rewritten after every finished study.
+    If a worker dies the pool is restarted for the unfinished studies; a study
+    is failed once it has crashed a worker more than crash_retries times.
+    """
+    out_dir = Path(__file__).resolve().parent.parent / "outputs"
+    workers = workers or default_workers(mem_per_worker_gb)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # every thread pool of a worker gets its share unless set explicitly
+    engine_kwargs = dict(engine_kwargs or {})
+    for name in ("log_threads", "seg_threads", "io_threads"):
+        if engine_kwargs.get(name) is None:
+            engine_kwargs[name] = threads
+
+    rows, todo = [], []
+    for folder, sid in studies:
+        if skip_existing and (out_dir / f"{sid}_findings.json").exists():
+            rows.append({"study_id": sid, "study_folder": str(folder), "status": "skipped"})
+        else:
+            todo.append((folder, sid))
+
+    print(f"[BATCH] {len(studies)} studies, {len(todo)} to run, "
+          f"{len(rows)} skipped, {workers} workers x {threads} threads")
+    _write_summary(rows, summary_csv)
+    if not todo:
+        return rows
+
+    ctx = mp.get_context("spawn")
+    pending, crashes = list(todo), {}
+    while pending:
+        # studies that were running when a worker died are rerun one at a time,
+        # so a repeated crash is pinned on the study that causes it
+        suspects = [s for s in pending if crashes.get(s[1])]
+        batch = suspects or pending
+        n = 1 if suspects else workers
+        broken = []
+        with ProcessPoolExecutor(max_workers=n, mp_context=ctx,
+                                 initializer=_batch_worker_init,
+                                 initargs=(cache_dir, cache_max_gb, threads, engine_kwargs)) as pool:
+            futures = {pool.submit(_batch_run_one, folder, sid): (folder, sid) for folder, sid in batch}
+            for fut in as_completed(futures):
+                folder, sid = futures[fut]
+                try:
+                    row = fut.result()
+                except BrokenProcessPool:
+                    # a worker was killed (usually OOM); every unfinished future fails with it
+                    broken.append((folder, sid))
+                    continue
+                except Exception as e:
+                    row = {"study_id": sid, "study_folder": str(folder),
+                           "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                rows.append(row)
+                print(f"[BATCH] {len(rows)}/{len(studies)} {sid}: {row['status']}")
+                _write_summary(rows, summary_csv)
+
+        pending = [s for s in pending if s not in batch] + broken
+        if not broken:
+            continue
+        # workers take jobs in submission order, so the crashed study is among
+        # the first n unfinished ones (exactly the first when n == 1)
+        broken.sort(key=batch.index)
+        for folder, sid in broken[:n]:
+            crashes[sid] = crashes.get(sid, 0) + 1
+            if crashes[sid] > crash_retries:
+                pending.remove((folder, sid))
+                rows.append({"study_id": sid, "study_folder": str(folder), "status": "failed",
+                             "error": f"worker crashed {crashes[sid]} times"})
+                print(f"[BATCH] {len(rows)}/{len(studies)} {sid}: failed (worker crashed)")
+                _write_summary(rows, summary_csv)
+        print(f"[BATCH] Worker pool broke; restarting with {len(pending)} studies left")
+
+    print(f"[BATCH] Summary written to {summary_csv}")
+    return rows
 
-    # -------------------------
-    # 11. Compute lung-level metrics
-    # -------------------------
-    print("\n[11] Computing lung-level metrics...")
-    lung_volume_for_metrics = vol_res.copy()
-    lung_volume_for_metrics[~lung_mask.astype(bool)] = 0
 
-    # -------------------------
-    # 12. Build JSON
-    # -------------------------
-    print("\n[12] Building findings.json...")
-    OUT_DIR = ROOT/"outputs"
-    OUT_DIR.mkdir(exist_ok=True, parents=True)
-    json_path = OUT_DIR / f"{study_id}_findings.json"
-
-    processing_time = time.time() - start_proc
-
-    builder_mod.build_findings_json(
-        study_id=study_id,
-        spacing=new_spacing,
-        volume_shape=vol_res.shape,
-        filtered_candidates=filtered_final,
-        features=features_final,
-        malignancy_scores=malignancy_scores,
-        uncertainties=uncertainties,
-        output_path=str(json_path),
-        processing_time_seconds=processing_time,
-        lung_volume_for_metrics=lung_volume_for_metrics
-    )
+# ---------------
+# Main pipeline
+# ---------------
+def main(args):
+    print(f"\n[PIPELINE] Starting pipeline...")
 
-    print(f"[DONE] Saved findings.json at {json_path}\n")
+    try:
+        engine = PipelineEngine(cache_dir=args.cache_dir, cache_max_gb=args.cache_max_gb,
+                                **engine_options(args))
+    except Exception as e:
+        print("\n[ERROR] Failed loading modules.")
+        print(str(e))
+        traceback.print_exc()
+        raise
+
+    print(f"[PIPELINE] Project root: {engine.root}")
+    return engine.run(args.study_folder, args.study_id, trace_path=args.trace_path)
+
+
+def engine_options(args):
+    return {
+        "seg_mode": args.seg_mode,
+        "seg_downsample": args.seg_downsample,
+        "seg_batch_size": args.seg_batch_size,
+        "seg_threads": args.seg_threads,
+        "mem_budget_gb": args.mem_budget_gb,
+        "volume_store_dir": args.volume_store_dir,
+        "log_threads": args.log_threads,
+        "io_threads": args.io_threads,
+        "detector": args.detector,
+        "max_candidates": args.max_candidates,
+        "max_candidates_per_lung": args.max_candidates_per_lung,
+        "reject_gates": json.loads(args.reject_gates) if args.reject_gates else None,
+        "segment_patches": not args.no_segment_patches,
+        "order_by_response": not args.raster_order,
+    }
+
+
+def main_batch(args):
+    if args.manifest:
+        studies = read_manifest(args.manifest)
+    else:
+        studies = discover_studies(args.batch_dir)
+
+    return run_batch(
+        studies,
+        summary_csv=args.summary_csv,
+        workers=args.workers,
+        mem_per_worker_gb=args.mem_per_worker_gb,
+        skip_existing=not args.force,
+        cache_dir=args.cache_dir,
+        cache_max_gb=args.cache_max_gb,
+        engine_kwargs=engine_options(args),
+        crash_retries=args.crash_retries,
+    )
 
 
 
@@ -343,7 +936,43 @@ def main(args):
 # ----------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--study_folder", required=True, help="Path to patient folder containing DICOM series")
+    parser.add_argument("--study_folder", required=False, help="Patient folder (or .zip) containing DICOM series")
     parser.add_argument("--study_id", required=False, help="Study ID to save into JSON")
+    parser.add_argument("--cache_dir", required=False, help="Stage checkpoint cache directory (off if omitted)")
+    parser.add_argument("--cache_max_gb", type=float, default=20.0, help="Stage cache size cap in GB (LRU eviction)")
+    parser.add_argument("--trace_path", required=False, help="Write per-stage timings as a Chrome-trace JSON file")
+    parser.add_argument("--seg_mode", default="full", choices=["full", "fast", "classical"],
+                        help="Lung segmentation: full lungmask, fast (downsampled lungmask) or classical (no network)")
+    parser.add_argument("--seg_downsample", type=int, default=2, help="fast mode: run lungmask on every N-th slice")
+    parser.add_argument("--seg_batch_size", type=int, default=20, help="lungmask slices per forward pass")
+    parser.add_argument("--seg_threads", type=int, default=None, help="torch CPU threads for lungmask")
+    parser.add_argument("--mem_budget_gb", type=float, default=None,
+                        help="Memory-budget mode: sequential stages, in-place LoG, peak RSS reported against this budget")
+    parser.add_argument("--detector", default="log", choices=["log", "dog"],
+                        help="Candidate detector: single-scale LoG or multi-scale DoG (returns blob sizes)")
+    parser.add_argument("--max_candidates", type=int, default=None, help="Keep at most this many detector peaks (strongest)")
+    parser.add_argument("--max_candidates_per_lung", type=int, default=None, help="LoG: keep at most this many peaks per lung label")
+    parser.add_argument("--io_threads", type=int, default=None, help="Threads for series discovery, DICOM decoding and resampling")
+    parser.add_argument("--log_threads", type=int, default=None, help="Threads for the tiled LoG detector (default: all cores)")
+    parser.add_argument("--reject_gates", required=False,
+                        help='Stage 8 rejection cascade as JSON, e.g. \'[{"name": "hu", "feature": "hu_mean", "op": ">", "value": -800}]\'')
+    parser.add_argument("--raster_order", action="store_true",
+                        help="Stage 7: suppress close peaks in detector order instead of strongest response first")
+    parser.add_argument("--no_segment_patches", action="store_true",
+                        help="Measure the whole threshold mask of each patch, not its central tissue component")
+    parser.add_argument("--volume_store_dir", required=False, help="Keep the 1 mm volume as <dir>/<study_id>.ctvol (off if omitted)")
+    parser.add_argument("--batch_dir", required=False, help="Batch mode: folder with one study per sub-folder")
+    parser.add_argument("--manifest", required=False, help="Batch mode: .csv (study_folder[,study_id]) or .txt list of study folders")
+    parser.add_argument("--workers", type=int, default=None, help="Batch worker processes (default: by cores and memory)")
+    parser.add_argument("--mem_per_worker_gb", type=float, default=6.0, help="Memory budget per batch worker")
+    parser.add_argument("--crash_retries", type=int, default=1, help="Batch: reruns of a study after it crashed a worker")
+    parser.add_argument("--summary_csv", default="batch_summary.csv", help="Batch per-study status/timing CSV")
+    parser.add_argument("--force", action="store_true", help="Batch: rerun studies that already have findings.json")
     args = parser.parse_args()
-    main(args)
+
+    if args.batch_dir or args.manifest:
+        main_batch(args)
+    elif args.study_folder:
+        main(args)
+    else:
+        parser.error("one of --study_folder, --batch_dir or --manifest is required")
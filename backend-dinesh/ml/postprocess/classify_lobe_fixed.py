@@ -1,3 +1,5 @@
+import numpy as np
+
 def classify_lobe(center, vol_shape):
     z, y, x = center
     Z, Y, X = vol_shape
@@ -21,3 +23,16 @@ def classify_lobe(center, vol_shape):
         return f"left {level} lobe"
     else:
         return f"right {level} lobe"
+
+# categorical codes for the candidate table (index into LOBE_NAMES)
+LOBE_NAMES = ("right upper lobe", "right middle lobe", "right lower lobe",
+              "left upper lobe", "left lingula", "left lower lobe")
+
+def classify_lobes(centers, vol_shape):
+    """Vectorised classify_lobe over (N,3) centers: int8 codes into LOBE_NAMES."""
+    centers = np.asarray(centers).reshape(-1, 3)
+    z, x = centers[:, 0], centers[:, 2]
+    Z, Y, X = vol_shape
+    level = np.select([z < Z * 0.33, z < Z * 0.66], [0, 1], 2)
+    left = x >= X // 2
+    return (3 * left + level).astype(np.int8)
@@ -1,3 +1,5 @@
+import numpy as np
+
 def classify_nodule_type(hu_mean):
     if hu_mean > -300:
         return "solid"
@@ -12,3 +14,11 @@ def classify_nodule_type(hu_mean):
         return "subsolid"
     else:
         return "ground-glass"
+
+# categorical codes for the candidate table (index into TYPE_NAMES)
+TYPE_NAMES = ("solid", "subsolid", "ground-glass")
+
+def classify_nodule_types(hu_mean):
+    """Vectorised classify_nodule_type: int8 codes into TYPE_NAMES."""
+    hu_mean = np.asarray(hu_mean)
+    return np.select([hu_mean > -300, hu_mean > -700], [0, 1], 2).astype(np.int8)
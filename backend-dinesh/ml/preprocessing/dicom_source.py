@@ -0,0 +1,93 @@
+# backend-dinesh/ml/preprocessing/dicom_source.py
+#
+# Where the DICOM slices come from: a folder on disk or a ZIP (path, bytes
+# or any seekable binary stream). Slices are addressed by their name
+# relative to the source, so the same series list works for both and ZIP
+# members are read in memory without extracting anything to disk.
+
+import io
+import os
+import zipfile
+from pathlib import Path
+
+
+class FolderSource:
+    kind = "folder"
+
+    def __init__(self, folder):
+        self.root = Path(folder)
+        self.name = self.root.name
+
+    def list(self):
+        names = []
+        for root, dirs, files in os.walk(self.root):
+            for f in files:
+                names.append((Path(root) / f).relative_to(self.root).as_posix())
+        return sorted(names)
+
+    def size(self, name):
+        return (self.root / name).stat().st_size
+
+    def open(self, name):
+        return open(self.root / name, "rb")
+
+    def read(self, name):
+        return (self.root / name).read_bytes()
+
+    def path(self, name):
+        return str(self.root / name)
+
+    def close(self):
+        pass
+
+
+class ZipSource:
+    kind = "zip"
+
+    def __init__(self, data, name="study"):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            fileobj = io.BytesIO(data)
+        elif isinstance(data, (str, Path)):
+            fileobj = str(data)
+            name = Path(data).stem
+        else:
+            fileobj = data  # seekable binary stream
+        self.zf = zipfile.ZipFile(fileobj, "r")
+        self.name = name
+        self._infos = {
+            i.filename: i for i in self.zf.infolist()
+            if not i.is_dir() and not i.filename.startswith("__MACOSX/")
+        }
+
+    def list(self):
+        return sorted(self._infos)
+
+    def size(self, name):
+        return self._infos[name].file_size
+
+    def open(self, name):
+        # streaming member; ZipFile serialises access to the shared handle
+        return self.zf.open(self._infos[name])
+
+    def read(self, name):
+        return self.zf.read(self._infos[name])
+
+    def path(self, name):
+        return f"{self.name}.zip/{name}"
+
+    def close(self):
+        self.zf.close()
+
+
+def open_source(study):
+    """Folder path, .zip path, ZIP bytes or a binary stream → source object."""
+    if isinstance(study, (FolderSource, ZipSource)):
+        return study
+    if isinstance(study, (bytes, bytearray, memoryview)) or hasattr(study, "read"):
+        return ZipSource(study)
+    p = Path(study)
+    if p.is_dir():
+        return FolderSource(p)
+    if p.is_file() and zipfile.is_zipfile(p):
+        return ZipSource(p)
+    raise FileNotFoundError(f"Study not found (expected a folder or a ZIP): {study}")
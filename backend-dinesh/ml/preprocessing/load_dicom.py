@@ -1,14 +1,133 @@
 import SimpleITK as sitk
 import numpy as np
+import io
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-def load_dicom_series(dicom_folder):
+import pydicom
+
+def _sitk_load(dicom_folder, file_names=None):
     reader = sitk.ImageSeriesReader()
-    dicom_names = reader.GetGDCMSeriesFileNames(dicom_folder)
+    if file_names:
+        dicom_names = list(file_names)
+    else:
+        dicom_names = reader.GetGDCMSeriesFileNames(dicom_folder)
     reader.SetFileNames(dicom_names)
     image = reader.Execute()
 
     volume = sitk.GetArrayFromImage(image).astype(np.int16)  # (Z,Y,X)
     spacing = list(image.GetSpacing())[::-1]  # (Z,Y,X)
+    meta = {
+        "origin": list(image.GetOrigin()),
+        "direction": list(image.GetDirection()),
+    }
+    return volume, spacing, meta
+
+def _read(path, source=None, **kw):
+    if source is None:
+        return pydicom.dcmread(path, **kw)
+    # whole member in one read; ZIP members are inflated in memory
+    return pydicom.dcmread(io.BytesIO(source.read(path)), **kw)
+
+def _decode_into(out, path, source=None):
+    """
+    Decode one slice and write HU = pixel * slope + intercept into `out` (int16 view).
+    Returns the slice's ImagePositionPatient (or None).
+    """
+    ds = _read(path, source)
+    pix = ds.pixel_array
+    slope = float(getattr(ds, "RescaleSlope", 1) or 1)
+    intercept = float(getattr(ds, "RescaleIntercept", 0) or 0)
+
+    if slope == 1.0 and intercept.is_integer():
+        # integer path: one int32 temporary per slice, cast straight into the volume
+        np.add(pix, int(intercept), out=out, dtype=np.int32, casting="unsafe")
+    else:
+        hu = pix.astype(np.float32)
+        hu *= slope
+        hu += intercept
+        np.rint(hu, out=hu)
+        np.clip(hu, -32768, 32767, out=hu)
+        out[...] = hu
+
+    ipp = getattr(ds, "ImagePositionPatient", None)
+    return [float(v) for v in ipp] if ipp is not None else None
+
+def load_dicom_volume(file_names, threads=None, source=None):
+    """
+    Decodes the slices (already sorted, e.g. by select_series) on a thread
+    pool straight into one preallocated int16 (Z,Y,X) HU volume.
+    source: optional dicom_source (folder / ZIP); file_names are then member names.
+    Returns (volume, spacing [z,y,x], meta) where meta holds origin,
+    direction (3x3 row-major, row/column/normal cosines as columns, like
+    SimpleITK) and orientation (IOP).
+    """
+    file_names = list(file_names)
+    first = _read(file_names[0], source, stop_before_pixels=True)
+    rows, cols = int(first.Rows), int(first.Columns)
+    if int(getattr(first, "SamplesPerPixel", 1) or 1) != 1:
+        raise ValueError("Only single-channel CT slices are supported")
+
+    ori = [float(v) for v in getattr(first, "ImageOrientationPatient", [1, 0, 0, 0, 1, 0])]
+    normal = np.cross(ori[:3], ori[3:])
+    dy, dx = [float(v) for v in getattr(first, "PixelSpacing", [1.0, 1.0])]
+
+    volume = np.empty((len(file_names), rows, cols), dtype=np.int16)
+
+    threads = threads or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # list() re-raises the first decoding error
+        positions = list(pool.map(lambda i: _decode_into(volume[i], file_names[i], source), range(len(file_names))))
+
+    # z spacing from the slice positions along the normal
+    if len(file_names) > 1 and all(p is not None for p in positions):
+        z = np.array([np.dot(normal, p) for p in positions])
+        dz = float(np.median(np.abs(np.diff(z)))) or 1.0
+    else:
+        dz = float(getattr(first, "SliceThickness", 1.0) or 1.0)
+
+    meta = {
+        "origin": positions[0] if positions and positions[0] is not None else [0.0, 0.0, 0.0],
+        # same layout as SimpleITK GetDirection(): axis vectors as columns, row-major
+        "direction": np.column_stack([ori[:3], ori[3:], normal]).ravel().astype(float).tolist(),
+        "orientation": ori,
+    }
+    return volume, [dz, dy, dx], meta
+
+def _sitk_load_source(source, file_names):
+    """SimpleITK needs real files: extract just this series to a temp dir."""
+    with tempfile.TemporaryDirectory(prefix="dicom_") as tmp:
+        paths = []
+        for i, name in enumerate(file_names):
+            p = os.path.join(tmp, f"{i:05d}.dcm")
+            with open(p, "wb") as f:
+                f.write(source.read(name))
+            paths.append(p)
+        return _sitk_load(tmp, paths)
+
+def load_dicom_series(dicom_folder, file_names=None, threads=None, return_meta=False, source=None):
+    """
+    file_names: optional slice list already sorted by select_series;
+    skips the GDCM directory scan when given and decodes in parallel.
+    source: optional dicom_source; file_names are then names inside it
+    (a ZIP is decoded in memory, never extracted).
+    Falls back to SimpleITK when pydicom cannot decode the slices.
+    """
+    if not file_names:
+        file_names = sitk.ImageSeriesReader().GetGDCMSeriesFileNames(dicom_folder)
+
+    try:
+        volume, spacing, meta = load_dicom_volume(file_names, threads=threads, source=source)
+    except Exception as e:
+        print(f"[load_dicom] Parallel decode failed ({e}); falling back to SimpleITK")
+        if source is not None and source.kind == "zip":
+            volume, spacing, meta = _sitk_load_source(source, file_names)
+        else:
+            if source is not None:
+                file_names = [source.path(f) for f in file_names]
+            volume, spacing, meta = _sitk_load(dicom_folder, file_names)
 
+    if return_meta:
+        return volume, spacing, meta
     return volume, spacing
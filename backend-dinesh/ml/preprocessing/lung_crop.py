@@ -0,0 +1,40 @@
+import numpy as np
+
+def lung_bbox(lung_mask, margin=16):
+    """
+    Bounding box of the lung mask grown by `margin` voxels on every side
+    (clipped to the volume). Returns a tuple of slices, or None when the
+    mask is empty.
+    The margin must cover the detector's filter support and half a
+    feature patch, so cropping does not change any result.
+    """
+    box = []
+    for axis in range(lung_mask.ndim):
+        other = tuple(a for a in range(lung_mask.ndim) if a != axis)
+        nz = np.flatnonzero(np.any(lung_mask, axis=other))
+        if nz.size == 0:
+            return None
+        lo = max(0, int(nz[0]) - margin)
+        hi = min(lung_mask.shape[axis], int(nz[-1]) + 1 + margin)
+        box.append(slice(lo, hi))
+    return tuple(box)
+
+def crop_to_lungs(volume, lung_mask, margin=16):
+    """
+    Contiguous copies of volume and mask inside the lung bounding box.
+    Returns (volume_crop, mask_crop, offset) where offset (z,y,x) maps
+    crop coordinates back: full = crop + offset.
+    """
+    box = lung_bbox(lung_mask, margin)
+    if box is None:
+        return volume, lung_mask, (0, 0, 0)
+    offset = tuple(s.start for s in box)
+    return np.ascontiguousarray(volume[box]), np.ascontiguousarray(lung_mask[box]), offset
+
+def to_full(points, offset):
+    """Crop (z,y,x) points (N,3) → full-volume coordinates, (N,3) int32."""
+    return np.asarray(points, dtype=np.int32).reshape(-1, 3) + np.asarray(offset, dtype=np.int32)
+
+def to_crop(points, offset):
+    """Full-volume (z,y,x) points (N,3) → crop coordinates, (N,3) int32."""
+    return np.asarray(points, dtype=np.int32).reshape(-1, 3) - np.asarray(offset, dtype=np.int32)
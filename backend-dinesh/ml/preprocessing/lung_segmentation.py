@@ -1,11 +1,121 @@
 import SimpleITK as sitk
+import numpy as np
+from scipy import ndimage
 from lungmask import mask
 
-def segment_lungs(volume):
+# One lungmask model per process (and batch size); building it reloads the weights.
+_INFERERS = {}
+
+SEG_MODES = ("full", "fast", "classical")
+
+def get_inferer(batch_size=20, force_cpu=False):
+    key = (batch_size, force_cpu)
+    if key not in _INFERERS:
+        if hasattr(mask, "LMInferer"):
+            _INFERERS[key] = mask.LMInferer(tqdm_disable=True, batch_size=batch_size, force_cpu=force_cpu)
+        else:
+            # older lungmask versions: keep the model, call mask.apply with it
+            _INFERERS[key] = mask.get_model("unet", "R231")
+    return _INFERERS[key]
+
+def _set_threads(threads):
+    if threads:
+        import torch
+        torch.set_num_threads(int(threads))
+
+def _apply(volume, inferer):
     # Convert numpy array → SITK image
     img = sitk.GetImageFromArray(volume)
 
-    # This is the correct API for older lungmask versions
-    mask_array = mask.apply(img)     # <-- THIS WORKS FOR YOUR VERSION
+    if hasattr(inferer, "apply"):
+        return inferer.apply(img)
+    return mask.apply(img, inferer)     # <-- THIS WORKS FOR OLDER VERSIONS
+
+def _segment_downsampled(volume, inferer, factor=2):
+    """
+    Network on every `factor`-th slice, label map brought back with
+    nearest-neighbour along z. lungmask already resizes each slice to
+    256x256, so the slice count is what sets its cost.
+    """
+    small = _apply(np.ascontiguousarray(volume[::factor]), inferer)
+    nearest = np.minimum(np.rint(np.arange(volume.shape[0]) / factor).astype(np.intp), small.shape[0] - 1)
+    return small[nearest]
+
+def classical_segment(volume, threshold=-320, min_fraction=0.1):
+    """
+    Threshold + connected components + hole filling, no network.
+    Air below `threshold` HU that does not touch the volume border is
+    kept; components smaller than min_fraction of the largest are
+    dropped; holes (vessels, nodules) are filled slice by slice.
+    Returns a uint8 mask labelled like lungmask (1 = right lung at low x,
+    2 = left lung), see _label_sides.
+    """
+    air = volume < threshold
+    lab, n = ndimage.label(air)
+    if n == 0:
+        return np.zeros(volume.shape, dtype=np.uint8)
+
+    border = np.unique(np.concatenate([
+        lab[[0, -1]].ravel(), lab[:, [0, -1]].ravel(), lab[:, :, [0, -1]].ravel()]))
+    sizes = np.bincount(lab.ravel(), minlength=n + 1)
+    sizes[0] = 0
+    sizes[border] = 0
+    if sizes.max() == 0:
+        return np.zeros(volume.shape, dtype=np.uint8)
+
+    keep = sizes >= min_fraction * sizes.max()
+    keep[0] = False
+    lungs = keep[lab]
+    del lab, air
+
+    for z in range(lungs.shape[0]):
+        if lungs[z].any():
+            lungs[z] = ndimage.binary_fill_holes(lungs[z])
+    return _label_sides(lungs)
+
+def _label_sides(lungs):
+    """
+    Boolean lung mask → uint8 labels 1 / 2 for the lung at low / high x.
+    Two or more components: each goes to the side of the midpoint between
+    the two largest ones. One component (lungs touching at the midline):
+    cut at the thinnest x column of its middle third.
+    """
+    out = lungs.astype(np.uint8)
+    lab, n = ndimage.label(lungs)
+    if n == 0:
+        return out
+    x = np.arange(lungs.shape[2])
+    if n >= 2:
+        sizes = np.bincount(lab.ravel(), minlength=n + 1)[1:]
+        mean_x = np.asarray(ndimage.mean(np.broadcast_to(x, lungs.shape), lab, np.arange(1, n + 1)))
+        a, b = np.argsort(-sizes, kind="stable")[:2]
+        cut = (mean_x[a] + mean_x[b]) / 2
+        side = np.r_[0, np.where(mean_x < cut, 1, 2)].astype(np.uint8)
+        return side[lab]
+    profile = np.count_nonzero(lungs, axis=(0, 1))
+    cols = np.flatnonzero(profile)
+    lo, hi = cols[0], cols[-1] + 1
+    third = (hi - lo) // 3
+    cut = lo + third + int(np.argmin(profile[lo + third:hi - third])) if hi - lo >= 3 else (lo + hi) // 2
+    out[:, :, cut:] *= 2
+    return out
+
+def segment_lungs(volume, inferer=None, mode="full", downsample=2, batch_size=20, threads=None):
+    """
+    mode="full":      lungmask on every slice (reference).
+    mode="fast":      lungmask on every `downsample`-th slice, nearest upsampling.
+    mode="classical": classical_segment(), no network; lowest latency.
+    batch_size / threads: lungmask slices per forward pass / torch CPU threads.
+    """
+    if mode not in SEG_MODES:
+        raise ValueError(f"Unknown segmentation mode: {mode} (expected one of {SEG_MODES})")
+    if mode == "classical":
+        return classical_segment(volume)
+
+    _set_threads(threads)
+    if inferer is None:
+        inferer = get_inferer(batch_size=batch_size)
 
-    return mask_array
+    if mode == "fast" and downsample > 1:
+        return _segment_downsampled(volume, inferer, factor=downsample)
+    return _apply(volume, inferer)
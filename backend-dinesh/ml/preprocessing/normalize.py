@@ -1,6 +1,9 @@
 import numpy as np
 
-def clip_and_normalize(vol):
-    vol = np.clip(vol, -1000, 400)
-    vol = (vol + 1000) / 1400
-    return vol.astype("float32")
+def clip_and_normalize(vol, dtype=np.float32):
+    """HU → [0, 1] over [-1000, 400]; one output array, the rest in place."""
+    out = vol.astype(dtype)
+    np.clip(out, -1000, 400, out=out)
+    out += 1000
+    out /= 1400
+    return out
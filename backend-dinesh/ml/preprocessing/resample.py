@@ -1,25 +1,115 @@
 import SimpleITK as sitk
 import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-def resample_to_iso(volume, spacing, new_spacing=[1.0,1.0,1.0]):
+_SITK_TYPES = {np.dtype(np.int16): sitk.sitkInt16, np.dtype(np.float32): sitk.sitkFloat32}
+
+def _output_shape(shape, spacing, new_spacing):
+    # (Z,Y,X) sizes covering the same physical extent
+    return [int(round(n * s / ns)) for n, s, ns in zip(shape, spacing, new_spacing)]
+
+def _resample_sitk(volume, spacing, new_spacing, dtype=None, threads=None):
     img = sitk.GetImageFromArray(volume)
     img.SetSpacing(spacing[::-1])  # simpleitk uses (x,y,z)
 
-    original_size = img.GetSize()
-    original_spacing = img.GetSpacing()
-
-    new_size = [
-        int(round(original_size[0] * original_spacing[0] / new_spacing[2])),
-        int(round(original_size[1] * original_spacing[1] / new_spacing[1])),
-        int(round(original_size[2] * original_spacing[2] / new_spacing[0])),
-    ]
+    new_size = _output_shape(volume.shape, spacing, new_spacing)
 
     resampler = sitk.ResampleImageFilter()
     resampler.SetOutputSpacing(new_spacing[::-1])
     resampler.SetSize(new_size[::-1])
     resampler.SetInterpolator(sitk.sitkLinear)
+    if dtype is not None:
+        resampler.SetOutputPixelType(_SITK_TYPES[np.dtype(dtype)])
+    if threads:
+        resampler.SetNumberOfThreads(threads)
 
     new_img = resampler.Execute(img)
     new_vol = sitk.GetArrayFromImage(new_img)
 
     return new_vol, new_spacing
+
+# ---------------------------
+# Slab-wise linear resampling
+# ---------------------------
+def _linear_taps(n_out, n_in, scale):
+    """Index pairs + weights of output samples i*scale (edge-clamped)."""
+    pos = np.minimum(np.arange(n_out) * scale, n_in - 1)
+    i0 = np.floor(pos).astype(np.intp)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    w = (pos - i0).astype(np.float32)
+    return i0, i1, w
+
+def _lerp(a, i0, i1, w, axis):
+    """Linear interpolation of float32 `a` along one axis at the given taps."""
+    shape = [1] * a.ndim
+    shape[axis] = -1
+    w = w.reshape(shape)
+    lo = np.take(a, i0, axis=axis)
+    hi = np.take(a, i1, axis=axis)
+    hi -= lo
+    hi *= w
+    lo += hi
+    return lo
+
+def _resample_slab(volume, out, z_lo, z_hi, zt, yt, xt):
+    """Fill out[z_lo:z_hi]; only the input slices it needs (+1 overlap) are read."""
+    i0, i1, w = zt[0][z_lo:z_hi], zt[1][z_lo:z_hi], zt[2][z_lo:z_hi]
+    first, last = int(i0[0]), int(i1[-1]) + 1
+    slab = volume[first:last].astype(np.float32)
+    slab = _lerp(slab, i0 - first, i1 - first, w, axis=0)
+    if yt is not None:
+        slab = _lerp(slab, *yt, axis=1)
+    if xt is not None:
+        slab = _lerp(slab, *xt, axis=2)
+
+    if np.issubdtype(out.dtype, np.integer):
+        info = np.iinfo(out.dtype)
+        np.rint(slab, out=slab)
+        np.clip(slab, info.min, info.max, out=slab)
+    out[z_lo:z_hi] = slab
+
+def resample_slabs(volume, spacing, new_spacing=[1.0,1.0,1.0], dtype=np.int16,
+                   threads=None, slab=32):
+    """
+    Trilinear resampling done as separable z / y / x passes over output
+    z-slabs of `slab` slices, on a bounded thread pool.
+    Peak extra memory is ~threads x slab float32 slices, whatever the scan
+    length. When the in-plane spacing already matches, only z is rescaled.
+    dtype: output type (int16 HU, rounded and clipped, or float32).
+    """
+    spacing = [float(s) for s in spacing]
+    new_spacing = [float(s) for s in new_spacing]
+    shape_out = _output_shape(volume.shape, spacing, new_spacing)
+    out = np.empty(shape_out, dtype=dtype)
+
+    zt = _linear_taps(shape_out[0], volume.shape[0], new_spacing[0] / spacing[0])
+    # z-only fast path: in-plane grid unchanged
+    yt = xt = None
+    if shape_out[1] != volume.shape[1] or spacing[1] != new_spacing[1]:
+        yt = _linear_taps(shape_out[1], volume.shape[1], new_spacing[1] / spacing[1])
+    if shape_out[2] != volume.shape[2] or spacing[2] != new_spacing[2]:
+        xt = _linear_taps(shape_out[2], volume.shape[2], new_spacing[2] / spacing[2])
+
+    threads = threads or min(8, os.cpu_count() or 1)
+    bounds = [(z, min(z + slab, shape_out[0])) for z in range(0, shape_out[0], slab)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # numpy releases the GIL in the heavy loops; list() re-raises errors
+        list(pool.map(lambda b: _resample_slab(volume, out, b[0], b[1], zt, yt, xt), bounds))
+
+    return out, new_spacing
+
+def resample_to_iso(volume, spacing, new_spacing=[1.0,1.0,1.0], mode="sitk",
+                    dtype=None, threads=None, slab=32):
+    """
+    mode="sitk": one SimpleITK ResampleImageFilter pass (output keeps the
+    input type unless dtype is given).
+    mode="slab": resample_slabs(), bounded memory and threads (dtype
+    defaults to int16).
+    """
+    if mode == "slab":
+        return resample_slabs(volume, spacing, new_spacing, dtype=dtype or np.int16,
+                              threads=threads, slab=slab)
+    if mode != "sitk":
+        raise ValueError(f"Unknown resample mode: {mode}")
+    return _resample_sitk(volume, spacing, new_spacing, dtype=dtype, threads=threads)
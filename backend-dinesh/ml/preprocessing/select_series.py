@@ -1,19 +1,129 @@
+import importlib.util
 import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-def find_main_ct_series(patient_folder):
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+# sibling module, loaded by path like the pipeline does (ml/ is not a package)
+_spec = importlib.util.spec_from_file_location(
+    "dicom_source", str(Path(__file__).resolve().parent / "dicom_source.py"))
+dicom_source = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(dicom_source)
+open_source = dicom_source.open_source
+
+# only these tags are parsed; pixel data is never read
+HEADER_TAGS = [
+    "SeriesInstanceUID", "Modality", "SliceThickness", "ImageType",
+    "ImagePositionPatient", "ImageOrientationPatient", "InstanceNumber",
+    "Rows", "Columns",
+]
+
+def read_header(path, source=None):
     """
-    Returns the path to the main CT series folder for a LIDC-IDRI patient.
-    We pick the folder with the highest number of DICOM slices (usually > 50).
+    Header-only read. Returns a small dict, or None if not a DICOM image.
+    path is a file path, or a member name when a source (folder / ZIP) is given.
+    """
+    try:
+        if source is None:
+            ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+        else:
+            with source.open(path) as fh:
+                ds = pydicom.dcmread(fh, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    except (InvalidDicomError, OSError, ValueError, EOFError, TypeError, KeyError):
+        return None
+
+    uid = getattr(ds, "SeriesInstanceUID", None)
+    if uid is None or getattr(ds, "Rows", None) is None:
+        return None
+    image_type = [str(t).upper() for t in (getattr(ds, "ImageType", None) or [])]
+
+    def _floats(v, n):
+        try:
+            v = [float(x) for x in v]
+            return v if len(v) == n else None
+        except (TypeError, ValueError):
+            return None
+
+    try:
+        thickness = float(ds.SliceThickness) if getattr(ds, "SliceThickness", None) not in (None, "") else None
+    except (TypeError, ValueError):
+        thickness = None
+
+    return {
+        "path": path,
+        "series_uid": str(uid),
+        "modality": str(getattr(ds, "Modality", "") or ""),
+        "thickness": thickness,
+        "localizer": "LOCALIZER" in image_type,
+        "position": _floats(getattr(ds, "ImagePositionPatient", None), 3),
+        "orientation": _floats(getattr(ds, "ImageOrientationPatient", None), 6),
+        "instance": int(getattr(ds, "InstanceNumber", 0) or 0),
+    }
+
+def _slice_order(slices):
+    """Sort along the slice normal (ImagePositionPatient · normal), else InstanceNumber."""
+    ori = slices[0]["orientation"]
+    if ori and all(s["position"] for s in slices):
+        normal = np.cross(ori[:3], ori[3:])
+        return sorted(slices, key=lambda s: (float(np.dot(normal, s["position"])), s["instance"]))
+    return sorted(slices, key=lambda s: s["instance"])
+
+def discover_series(patient_folder, max_workers=16):
+    """
+    Reads every file's DICOM header in parallel threads (no pixel data),
+    groups slices by SeriesInstanceUID and returns the series best-first:
+    CT before other modalities, then most slices, then thinnest slices.
+    patient_folder: folder, ZIP path/bytes, or a dicom_source object.
+    Each series: {series_uid, modality, count, slice_thickness, folder, files}
+    with files (names relative to the source) already sorted in slice order.
     """
-    best_folder = None
-    best_count = 0
+    source = open_source(patient_folder)
+    names = source.list()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        headers = [h for h in pool.map(lambda n: read_header(n, source), names)
+                   if h is not None and not h["localizer"]]
+
+    groups = {}
+    for h in headers:
+        groups.setdefault(h["series_uid"], []).append(h)
 
-    for root, dirs, files in os.walk(patient_folder):
-        # Count how many files look like DICOM slices
-        dcm_files = [f for f in files if f.lower().endswith(".dcm")]
+    series = []
+    for uid, slices in groups.items():
+        slices = _slice_order(slices)
+        thick = [s["thickness"] for s in slices if s["thickness"]]
+        files = [s["path"] for s in slices]
+        series.append({
+            "series_uid": uid,
+            "modality": slices[0]["modality"],
+            "count": len(files),
+            "slice_thickness": float(np.median(thick)) if thick else None,
+            "folder": posixpath.commonpath([posixpath.dirname(f) for f in files]),
+            "files": files,
+        })
 
-        if len(dcm_files) > best_count:
-            best_count = len(dcm_files)
-            best_folder = root
+    series.sort(key=lambda s: (
+        s["modality"].upper() == "CT",
+        s["count"],
+        -(s["slice_thickness"] or 1e6),
+    ), reverse=True)
+    return series
 
-    return best_folder, best_count
+def select_main_series(patient_folder, max_workers=16):
+    """Best series from discover_series(), or None."""
+    series = discover_series(patient_folder, max_workers=max_workers)
+    return series[0] if series else None
+
+def find_main_ct_series(patient_folder):
+    """
+    Returns the path to the main CT series folder for a LIDC-IDRI patient.
+    Kept for older callers; uses the header-based discovery above.
+    """
+    best = select_main_series(patient_folder)
+    if best is None:
+        return None, 0
+    return os.path.join(patient_folder, best["folder"]), best["count"]
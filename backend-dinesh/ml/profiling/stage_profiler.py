@@ -0,0 +1,178 @@
+# backend-dinesh/ml/profiling/stage_profiler.py
+#
+# Per-stage telemetry for the CT pipeline: wall time, CPU time, peak RSS
+# delta and input/output array sizes. summary() goes into the "profiling"
+# block of findings.json; write_chrome_trace() produces a file that can be
+# opened in chrome://tracing or https://ui.perfetto.dev.
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _proc_status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_bytes():
+    """High-water mark of this process' resident set size."""
+    hwm = _proc_status_kb("VmHWM")  # Linux; resettable, unlike ru_maxrss
+    if hwm is not None:
+        return hwm * 1024
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+    if psutil is not None:
+        mem = psutil.Process().memory_info()
+        return int(getattr(mem, "peak_wset", mem.rss))
+    return 0
+
+
+def reset_peak_rss():
+    """
+    Restart the high-water mark at the current RSS (Linux only), so a
+    long-lived worker reports the peak of the current case. Returns
+    True when it worked.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_bytes():
+    if psutil is not None:
+        return int(psutil.Process().memory_info().rss)
+    return 0
+
+
+def describe(obj):
+    """Small JSON-safe description of a stage input/output."""
+    if isinstance(obj, np.ndarray):
+        return {"shape": list(obj.shape), "dtype": str(obj.dtype), "nbytes": int(obj.nbytes)}
+    if isinstance(obj, (list, tuple)):
+        return {"len": len(obj)}
+    if isinstance(obj, (int, float, str, bool)) or obj is None:
+        return obj
+    return type(obj).__name__
+
+
+class StageRecord:
+    def __init__(self, name, inputs):
+        self.name = name
+        self.inputs = {k: describe(v) for k, v in inputs.items()}
+        self.outputs_info = {}
+        self.extra = {}
+        self.tid = threading.get_ident()
+
+    def outputs(self, **outputs):
+        self.outputs_info.update({k: describe(v) for k, v in outputs.items()})
+
+    def note(self, **values):
+        self.extra.update(values)
+
+    def as_dict(self):
+        d = {
+            "name": self.name,
+            "start_seconds": round(self.start, 6),
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": round(self.cpu, 6),
+            "peak_rss_delta_bytes": self.peak_rss_delta,
+            "rss_bytes": self.rss_after,
+            "inputs": self.inputs,
+            "outputs": self.outputs_info,
+        }
+        d.update(self.extra)
+        return d
+
+
+class StageProfiler:
+
+    def __init__(self, budget_bytes=None):
+        self.t0 = time.perf_counter()
+        self.budget_bytes = budget_bytes
+        self.peak_rss_start = peak_rss_bytes()
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **inputs):
+        rec = StageRecord(name, inputs)
+        peak_before = peak_rss_bytes()
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec.wall = time.perf_counter() - t0
+            # process CPU time: includes worker threads of BLAS / ITK / torch
+            rec.cpu = time.process_time() - cpu0
+            rec.start = t0 - self.t0
+            rec.peak_rss_delta = max(0, peak_rss_bytes() - peak_before)
+            rec.rss_after = current_rss_bytes()
+            with self._lock:
+                self.records.append(rec)
+
+    def summary(self):
+        recs = sorted(self.records, key=lambda r: r.start)
+        out = {
+            "total_wall_seconds": round(time.perf_counter() - self.t0, 6),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_rss_delta_bytes": max(0, peak_rss_bytes() - self.peak_rss_start),
+            "stages": [r.as_dict() for r in recs],
+        }
+        if self.budget_bytes:
+            out["memory_budget_bytes"] = int(self.budget_bytes)
+            out["within_budget"] = out["peak_rss_bytes"] <= self.budget_bytes
+        return out
+
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        events = [{
+            "name": "process_name", "ph": "M", "pid": pid,
+            "args": {"name": "lung-ai pipeline"},
+        }]
+        for r in sorted(self.records, key=lambda r: r.start):
+            events.append({
+                "name": r.name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": r.start * 1e6,
+                "dur": r.wall * 1e6,
+                "pid": pid,
+                "tid": r.tid,
+                "args": {
+                    "cpu_seconds": r.cpu,
+                    "peak_rss_delta_bytes": r.peak_rss_delta,
+                    "inputs": r.inputs,
+                    "outputs": r.outputs_info,
+                    **r.extra,
+                },
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"[PROFILE] Chrome trace written to {path}")
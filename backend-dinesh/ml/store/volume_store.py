@@ -0,0 +1,162 @@
+# backend-dinesh/ml/store/volume_store.py
+#
+# Persistent on-disk format for preprocessed (1 mm, int16 HU) CT volumes.
+#
+# <name>.ctvol/
+#   header.json   shape, chunk shape, spacing, origin, direction, lung bbox, ...
+#   blocks.i16    little-endian int16 chunks, each chunk contiguous on disk
+#
+# blocks.i16 is read through np.memmap as a (gz, gy, gx, cz, cy, cx) array,
+# so a slice or sub-block only touches the chunks that overlap it; the rest
+# of the scan is never read. Edge chunks are padded with `fill`.
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+FORMAT = "ctvol"
+VERSION = 1
+DTYPE = np.dtype("<i2")
+
+
+def _grid(shape, chunk):
+    return [-(-n // c) for n, c in zip(shape, chunk)]
+
+
+def write_volume(path, volume, spacing, origin=None, direction=None, lung_bbox=None,
+                 chunk=(64, 64, 64), fill=-1024, **extra):
+    """
+    Writes volume (Z,Y,X) as a .ctvol directory and returns its path.
+    lung_bbox: [[z0, z1], [y0, y1], [x0, x1]] (half-open, voxel indices).
+    extra: additional JSON-safe header fields (e.g. study_id).
+    The directory is written next to its final name and renamed into
+    place, so readers never see a half-written volume.
+    """
+    path = Path(path)
+    shape = [int(n) for n in volume.shape]
+    chunk = [int(min(c, n)) or 1 for c, n in zip(chunk, shape)]
+    grid = _grid(shape, chunk)
+
+    header = {
+        "format": FORMAT,
+        "version": VERSION,
+        "dtype": DTYPE.str,
+        "shape": shape,
+        "chunk": chunk,
+        "grid": grid,
+        "fill": int(fill),
+        "spacing": [float(s) for s in spacing],
+        "origin": [float(v) for v in origin] if origin is not None else [0.0, 0.0, 0.0],
+        "direction": [float(v) for v in direction] if direction is not None else None,
+        "lung_bbox": [[int(a), int(b)] for a, b in lung_bbox] if lung_bbox is not None else None,
+        **extra,
+    }
+
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        blocks = np.memmap(tmp / "blocks.i16", dtype=DTYPE, mode="w+", shape=tuple(grid + chunk))
+        cz, cy, cx = chunk
+        for iz in range(grid[0]):
+            slab = volume[iz * cz:(iz + 1) * cz]
+            for iy in range(grid[1]):
+                for ix in range(grid[2]):
+                    src = slab[:, iy * cy:(iy + 1) * cy, ix * cx:(ix + 1) * cx]
+                    dst = blocks[iz, iy, ix]
+                    if src.shape != dst.shape:
+                        dst[...] = fill
+                    dst[:src.shape[0], :src.shape[1], :src.shape[2]] = src
+        blocks.flush()
+        del blocks
+        (tmp / "header.json").write_text(json.dumps(header, indent=2))
+
+        if path.exists():
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+class VolumeStore:
+    """
+    Lazy reader for a .ctvol directory.
+
+        vs = VolumeStore("outputs/volumes/case.ctvol")
+        vs.shape, vs.spacing, vs.lung_bbox
+        ax = vs[120]                  # one axial slice (Y, X)
+        roi = vs[100:132, 200:264, :] # sub-block, int16
+        lungs = vs.lung()             # the lung bounding box
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.header = json.loads((self.path / "header.json").read_text())
+        if self.header.get("format") != FORMAT:
+            raise ValueError(f"Not a {FORMAT} volume: {self.path}")
+        self.shape = tuple(self.header["shape"])
+        self.chunk = tuple(self.header["chunk"])
+        self.grid = tuple(self.header["grid"])
+        self.spacing = self.header["spacing"]
+        self.origin = self.header["origin"]
+        self.direction = self.header.get("direction")
+        self.lung_bbox = self.header.get("lung_bbox")
+        self.dtype = np.dtype(self.header["dtype"])
+        self._blocks = np.memmap(self.path / "blocks.i16", dtype=self.dtype, mode="r",
+                                 shape=self.grid + self.chunk)
+
+    def _ranges(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError("ctvol volumes are 3-D")
+        key = key + (slice(None),) * (3 - len(key))
+
+        ranges, squeeze = [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step != 1:
+                    raise IndexError("only unit-step slices are supported")
+                ranges.append((start, max(start, stop)))
+            else:
+                i = int(k)
+                i = i + n if i < 0 else i
+                if not 0 <= i < n:
+                    raise IndexError(f"index {k} out of range for axis {axis} of size {n}")
+                ranges.append((i, i + 1))
+                squeeze.append(axis)
+        return ranges, tuple(squeeze)
+
+    def __getitem__(self, key):
+        ranges, squeeze = self._ranges(key)
+        out = np.empty([b - a for a, b in ranges], dtype=self.dtype)
+
+        (z0, z1), (y0, y1), (x0, x1) = ranges
+        cz, cy, cx = self.chunk
+        # copy the overlap of every chunk the request touches
+        for iz in range(z0 // cz, -(-z1 // cz)):
+            za, zb = max(z0, iz * cz), min(z1, (iz + 1) * cz)
+            for iy in range(y0 // cy, -(-y1 // cy)):
+                ya, yb = max(y0, iy * cy), min(y1, (iy + 1) * cy)
+                for ix in range(x0 // cx, -(-x1 // cx)):
+                    xa, xb = max(x0, ix * cx), min(x1, (ix + 1) * cx)
+                    out[za - z0:zb - z0, ya - y0:yb - y0, xa - x0:xb - x0] = \
+                        self._blocks[iz, iy, ix, za - iz * cz:zb - iz * cz,
+                                     ya - iy * cy:yb - iy * cy, xa - ix * cx:xb - ix * cx]
+        return out.squeeze(axis=squeeze) if squeeze else out
+
+    def lung(self):
+        """The lung bounding box sub-volume (whole volume if no bbox was stored)."""
+        if self.lung_bbox is None:
+            return self[:, :, :]
+        return self[tuple(slice(a, b) for a, b in self.lung_bbox)]
+
+    def read(self):
+        """Whole volume as one array."""
+        return self[:, :, :]